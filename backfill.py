@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+保存済みHTMLからの担当医表一括再解析（バックフィル）
+ディレクトリ内のHTMLスナップショットをプロセスプールで並列に解析し、
+重複する月を除いてJSONLに出力します
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from notion_auto_update import parse_source_page
+from schedule_fingerprint import canonical_calendar, fingerprint_calendar
+
+HTML_EXTENSIONS = ('.html', '.htm')
+
+# ファイル名に含まれる取得日時（例: Web Archive の 20251003123456）
+SNAPSHOT_PATTERN = re.compile(r'(?<!\d)(\d{14}|\d{8})(?!\d)')
+
+def find_snapshots(directory):
+    """ディレクトリ内のHTMLファイルを再帰的に列挙（ファイル名の取得日時順、日時がないものは先頭でパス順）"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(HTML_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths, key=lambda path: (snapshot_time(path) or '', path))
+
+def snapshot_time(path):
+    """ファイル名から取得日時を推定"""
+    match = SNAPSHOT_PATTERN.search(os.path.basename(path))
+    return match.group(1) if match else None
+
+def parse_snapshot(path):
+    """HTMLスナップショット1件を解析（ワーカープロセスで実行）
+
+    戻り値: (パス, 正規化したカレンダーのリスト, エラーメッセージ)
+    """
+    try:
+        # 自動更新と同じ解析処理（終日・複数医師の記載を分割する）
+        with open(path, 'rb') as f:
+            calendars = parse_source_page(f.read())
+
+        return path, [
+            dict(canonical_calendar(calendar), fingerprint=fingerprint_calendar(calendar))
+            for calendar in calendars
+        ], None
+
+    except Exception as e:
+        return path, [], str(e)
+
+def run_backfill(directory, output, workers=None):
+    """バックフィルを実行し、出力した月数を返す"""
+    paths = find_snapshots(directory)
+    total = len(paths)
+    if not total:
+        print(f"HTMLファイルが見つかりませんでした: {directory}", file=sys.stderr)
+        return 0
+
+    seen = set()
+    written = 0
+    errors = 0
+
+    with open(output, 'w', encoding='utf-8') as out, ProcessPoolExecutor(max_workers=workers) as executor:
+        # map は入力順に結果を返すため、重複時に残るのは常に最も古いスナップショット
+        chunksize = max(1, total // ((workers or os.cpu_count() or 1) * 4))
+        results = executor.map(parse_snapshot, paths, chunksize=chunksize)
+
+        for done, (path, calendars, error) in enumerate(results, start=1):
+            if error:
+                errors += 1
+                print(f"\n解析エラー: {path}: {error}", file=sys.stderr)
+
+            for calendar in calendars:
+                if calendar['fingerprint'] in seen:
+                    continue
+                seen.add(calendar['fingerprint'])
+
+                record = {
+                    'title': calendar['title'],
+                    'fingerprint': calendar['fingerprint'],
+                    'source': os.path.relpath(path, directory),
+                    'snapshot': snapshot_time(path),
+                    'days': calendar['days'],
+                }
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                written += 1
+
+            print(f"\r進捗: {done}/{total} ファイル, {written} か月", end='', file=sys.stderr, flush=True)
+
+    print(file=sys.stderr)
+    print(f"解析ファイル数: {total}（エラー {errors} 件）", file=sys.stderr)
+    print(f"出力した月数（重複除去後）: {written}", file=sys.stderr)
+    return written
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description='保存済みHTMLから担当医表を一括再解析')
+    parser.add_argument('directory', help='HTMLスナップショットを保存したディレクトリ')
+    parser.add_argument('-o', '--output', default='backfill.jsonl', help='出力先のJSONLファイル')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='並列プロセス数（既定: CPUコア数）')
+    args = parser.parse_args()
+
+    run_backfill(args.directory, args.output, args.workers)
+
+if __name__ == "__main__":
+    main()
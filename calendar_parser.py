@@ -8,24 +8,54 @@
 import requests
 from bs4 import BeautifulSoup
 import re
+import argparse
+import codecs
+import html
+import os
+from html.parser import HTMLParser
+from requests.compat import chardet
 from datetime import datetime
 
-def get_calendar_data():
+from calendar_renderer import render_document
+from schedule_fingerprint import is_unchanged, save_state
+from run_deadline import request_timeout
+from run_profiler import profile_iter, profiled, run_profiled, stage
+from source_fetcher import SourceFetcher, parse_source_spec, tag_calendars
+
+CALENDAR_URL = 'https://www.myseikei.jp/information/'
+
+# 出力形式ごとの保存先
+OUTPUT_FILES = {
+    'text': 'result.txt',
+    'markdown': 'result.md',
+    'html': 'result.html',
+}
+
+# ストリーミング取得時の読み込み単位（バイト）
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# 文字コードを内容から推定する際に必要な、最初のASCII以外の文字以降のバイト数
+ENCODING_SAMPLE_SIZE = 1024
+
+CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+def get_calendar_data(deadline=None, url=CALENDAR_URL):
     """Webページからカレンダーデータを取得"""
-    url = 'https://www.myseikei.jp/information/'
-    
     try:
-        response = requests.get(url)
-        response.encoding = response.apparent_encoding
-        html = response.text
+        with stage("http:ページ取得"):
+            response = requests.get(url, timeout=request_timeout(deadline, "ページ取得"))
+            response.encoding = response.apparent_encoding
+            html = response.text
         
-        soup = BeautifulSoup(html, 'html.parser')
+        with stage("解析:HTML"):
+            soup = BeautifulSoup(html, 'html.parser')
         return soup
         
     except Exception as e:
         print(f"エラーが発生しました: {e}")
         return None
 
+@profiled("解析:HTML")
 def extract_calendar_info(soup):
     """カレンダー情報を抽出"""
     calendars = []
@@ -47,6 +77,159 @@ def extract_calendar_info(soup):
     
     return calendars
 
+class CalendarStreamParser(HTMLParser):
+    """HTMLを逐次解析し、担当医表の見出しと直後のテーブルだけを取り出す"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.calendars = []
+        self.finished = False
+        self.found_count = 0
+        self._h2_parts = None
+        self._pending_title = None
+        self._table_parts = None
+        self._table_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._table_parts is not None:
+            self._table_parts.append(self.get_starttag_text())
+            if tag == 'table':
+                self._table_depth += 1
+            return
+
+        if tag == 'h2':
+            self._h2_parts = []
+        elif tag == 'table' and self._pending_title:
+            self._table_parts = [self.get_starttag_text()]
+            self._table_depth = 1
+        elif tag == 'footer' and self.found_count:
+            # 担当医表の後にフッターが始まったら読み込み終了
+            self.finished = True
+
+    def handle_startendtag(self, tag, attrs):
+        if self._table_parts is not None:
+            self._table_parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self._table_parts is not None:
+            self._table_parts.append(f"</{tag}>")
+            if tag == 'table':
+                self._table_depth -= 1
+                if self._table_depth == 0:
+                    self._finish_table()
+            return
+
+        if tag == 'h2' and self._h2_parts is not None:
+            # 文字列はチャンクの境目で分割されるため、連結してから前後の空白を除く
+            title = ''.join(self._h2_parts).strip()
+            self._h2_parts = None
+            if '担当医表' in title:
+                self._pending_title = title
+            elif self.found_count and not self._pending_title:
+                # 担当医表の後に別の見出しが現れたら読み込み終了
+                self.finished = True
+
+    def handle_data(self, data):
+        if self._table_parts is not None:
+            self._table_parts.append(html.escape(data, quote=False))
+        elif self._h2_parts is not None:
+            self._h2_parts.append(data)
+
+    def _finish_table(self):
+        fragment = BeautifulSoup(''.join(self._table_parts), 'html.parser')
+        self.calendars.append({
+            'title': self._pending_title,
+            'table': fragment.find('table')
+        })
+        self.found_count += 1
+        self._pending_title = None
+        self._table_parts = None
+
+    def pop_calendars(self):
+        """解析済みのカレンダーを取り出す"""
+        calendars = self.calendars
+        self.calendars = []
+        return calendars
+
+def _detect_stream_encoding(response, head, final=False):
+    """ストリーミング取得時の文字コードを判定（ヘッダー → metaタグ → 先頭部分の内容）
+    
+    判定に必要な内容がまだ届いていない間は None を返す（final=True の場合は届いた分で判定）
+    """
+    content_type = response.headers.get('Content-Type', '').lower()
+    if 'charset=' in content_type and response.encoding:
+        return response.encoding
+
+    match = CHARSET_PATTERN.search(head)
+    if match:
+        encoding = match.group(1).decode('ascii')
+        try:
+            codecs.lookup(encoding)
+            return encoding
+        except LookupError:
+            pass
+    
+    if head.isascii():
+        return 'utf-8' if final else None
+    
+    # UTF-8 として正しければ UTF-8（末尾で途切れた文字は許容）
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=final)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    
+    # それ以外は一括取得時の apparent_encoding と同じ方法で、最初のASCII以外の文字以降から推定
+    sample = head[len(head) - len(head.lstrip(bytes(range(128)))):]
+    if len(sample) < ENCODING_SAMPLE_SIZE and not final:
+        return None
+    encoding = chardet.detect(sample)['encoding']
+    if not encoding:
+        raise ValueError(f"ページの文字コードを判定できませんでした: {response.url}")
+    return encoding
+
+def stream_calendar_info(url=CALENDAR_URL, chunk_size=STREAM_CHUNK_SIZE, deadline=None):
+    """Webページを逐次取得しながらカレンダー情報を抽出（ジェネレータ）
+    
+    最後の担当医表を読み終えた時点で接続を閉じ、残りの本文はダウンロードしない
+    """
+    response = requests.get(url, stream=True, timeout=request_timeout(deadline, "ページ取得"))
+    try:
+        response.raise_for_status()
+        parser = CalendarStreamParser()
+        decoder = None
+        head = b''
+        
+        for chunk in profile_iter("http:ページ取得", response.iter_content(chunk_size=chunk_size)):
+            if decoder is None:
+                # ASCII 以外の文字が届くまでは文字コードを判定できないため、先頭部分を溜めておく
+                head += chunk
+                encoding = _detect_stream_encoding(response, head)
+                if encoding is None:
+                    if deadline:
+                        deadline.check("ページ取得")
+                    continue
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+                chunk, head = head, b''
+            
+            with stage("解析:HTML"):
+                parser.feed(decoder.decode(chunk))
+            yield from parser.pop_calendars()
+            
+            if parser.finished:
+                break
+            if deadline:
+                deadline.check("ページ取得")
+        else:
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(_detect_stream_encoding(response, head, final=True))(errors='replace')
+            parser.feed(decoder.decode(head, final=True))
+            parser.close()
+            yield from parser.pop_calendars()
+    finally:
+        response.close()
+
+@profiled("解析:テーブル")
 def parse_calendar_table(table):
     """カレンダーテーブルを解析"""
     # ヘッダー行から曜日を取得
@@ -142,9 +325,9 @@ def parse_calendar_table(table):
                         # 医師名として扱う（AM/PMの区別がない場合はAMとして扱う）
                         am_doctors.append(remaining_text)
             
-            # 重複を除去
-            am_doctors = list(set(am_doctors))
-            pm_doctors = list(set(pm_doctors))
+            # 重複を除去（記載順を保持）
+            am_doctors = list(dict.fromkeys(am_doctors))
+            pm_doctors = list(dict.fromkeys(pm_doctors))
             
             # 結果を格納
             calendar_data.append({
@@ -157,63 +340,103 @@ def parse_calendar_table(table):
     
     return calendar_data
 
-def format_calendar_output(calendar_info):
-    """カレンダー情報をNotion用フォーマットで整形"""
-    output_lines = []
-    
-    for calendar in calendar_info:
-        title = calendar['title']
-        data = calendar['data']
-        
-        # タイトルを整形
-        output_lines.append(f"🗓️ {title}")
-        output_lines.append("")
-        
-        # 日付順にソート
-        data.sort(key=lambda x: x['day'])
-        
-        # 各日付の情報を出力
-        for day_info in data:
-            day = day_info['day']
-            weekday = day_info['weekday']
-            am_doctors = day_info['am_doctors']
-            pm_doctors = day_info['pm_doctors']
-            
-            output_lines.append(f"{day}日（{weekday}）")
-            
-            # AM担当医
-            if am_doctors:
-                am_text = "、".join(am_doctors)
-                output_lines.append(f"AM：{am_text}")
-            else:
-                output_lines.append("AM：記載なし")
-            
-            # PM担当医
-            if pm_doctors:
-                pm_text = "、".join(pm_doctors)
-                output_lines.append(f"PM：{pm_text}")
-            else:
-                output_lines.append("PM：記載なし")
-            
-            output_lines.append("")
+def parse_source_html(html):
+    """取得したページのHTMLを解析（プロセスプールのワーカーで実行）"""
+    soup = BeautifulSoup(html, 'html.parser')
+    return [
+        {'title': calendar['title'], 'data': parse_calendar_table(calendar['table'])}
+        for calendar in extract_calendar_info(soup)
+    ]
+
+def load_sources(sources):
+    """複数の取得元を並列に取得・解析し、取得元を付けて1つのリストにまとめる"""
+    fetcher = SourceFetcher()
+    calendar_info = []
+    try:
+        futures = fetcher.submit_all(sources, parse_source_html)
+        for source, future in zip(sources, futures):
+            try:
+                _, source_calendars = future.result()
+            except Exception as e:
+                print(f"{source['name']} の取得に失敗しました: {e}")
+                continue
+            calendar_info.extend(tag_calendars(source_calendars, source, prefix_title=True))
+    finally:
+        fetcher.close()
     
-    return "\n".join(output_lines)
+    return calendar_info
+
+@profiled("描画")
+def format_calendar_output(calendar_info, target='text'):
+    """カレンダー情報を出力形式（text / markdown / html）で整形"""
+    return render_document(calendar_info, target)
 
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description='診療担当医カレンダー解析')
+    parser.add_argument('--stream', action='store_true',
+                        help='ページを逐次取得し、担当医表を読み終えた時点で接続を閉じる')
+    parser.add_argument('--format', choices=list(OUTPUT_FILES), default='text',
+                        help='出力形式（text: result.txt, markdown: result.md, html: result.html）')
+    parser.add_argument('--force', action='store_true',
+                        help='スケジュールに変更がなくても出力ファイルを書き直す')
+    parser.add_argument('--source', action='append', default=[], metavar='[名前=]URL',
+                        help='取得元のページ（複数指定すると並列に取得して1つにまとめる）')
+    parser.add_argument('--profile', action='store_true',
+                        help='プロファイルを calendar_parser.prof / calendar_parser.stages.txt に保存する')
+    args = parser.parse_args()
+    
+    if args.profile:
+        run_profiled(lambda: run(args), 'calendar_parser')
+    else:
+        run(args)
+
+def run(args):
+    """解析処理"""
     print("診療担当医カレンダー解析を開始します...")
     
-    # Webページからデータを取得
-    soup = get_calendar_data()
-    if not soup:
-        print("Webページの取得に失敗しました。")
-        return
+    sources = [parse_source_spec(spec) for spec in args.source]
+    url = sources[0]['url'] if sources else CALENDAR_URL
+    
+    if len(sources) > 1:
+        # 複数の取得元を並列に取得・解析
+        calendar_info = load_sources(sources)
+        if not calendar_info:
+            print("カレンダーが見つかりませんでした。")
+            return
+    else:
+        calendar_info = load_calendar_info(args, url)
+        if calendar_info is None:
+            return
+    
+    write_output(args, calendar_info)
+
+def load_calendar_info(args, url):
+    """1つの取得元からカレンダーを取得・解析（失敗時は None）"""
+    if args.stream:
+        # ストリーミング取得しながらカレンダー情報を抽出
+        try:
+            calendars = []
+            for calendar in stream_calendar_info(url):
+                print(f"カレンダー発見: {calendar['title']}")
+                calendars.append(calendar)
+        except Exception as e:
+            print(f"エラーが発生しました: {e}")
+            print("Webページの取得に失敗しました。")
+            return None
+    else:
+        # Webページからデータを取得
+        soup = get_calendar_data(url=url)
+        if not soup:
+            print("Webページの取得に失敗しました。")
+            return None
+        
+        # カレンダー情報を抽出
+        calendars = extract_calendar_info(soup)
     
-    # カレンダー情報を抽出
-    calendars = extract_calendar_info(soup)
     if not calendars:
         print("カレンダーが見つかりませんでした。")
-        return
+        return None
     
     # 各カレンダーを解析
     calendar_info = []
@@ -225,14 +448,26 @@ def main():
             'data': data
         })
     
+    return calendar_info
+
+def write_output(args, calendar_info):
+    """解析結果を出力ファイルに保存"""
+    output_file = OUTPUT_FILES[args.format]
+    
+    # スケジュールに変更がなければ書き直さない
+    if not args.force and os.path.exists(output_file) and is_unchanged(output_file, calendar_info):
+        print(f"スケジュールに変更がないため {output_file} の更新をスキップしました。")
+        return
+    
     # 結果を整形
-    output_text = format_calendar_output(calendar_info)
+    output_text = format_calendar_output(calendar_info, args.format)
     
     # ファイルに保存
-    with open('result.txt', 'w', encoding='utf-8') as f:
+    with open(output_file, 'w', encoding='utf-8') as f:
         f.write(output_text)
+    save_state(output_file, calendar_info)
     
-    print("result.txt に診療担当医カレンダーを保存しました。")
+    print(f"{output_file} に診療担当医カレンダーを保存しました。")
     print(f"抽出されたカレンダー数: {len(calendar_info)}")
     
     # 結果のプレビューを表示
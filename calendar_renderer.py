@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+診療担当医カレンダーの描画
+解析済みデータ（parse_calendar_table の結果）から
+Notionブロック・テキスト・Markdown・HTML を直接生成します
+"""
+
+import html
+from functools import lru_cache
+
+NO_ENTRY = "記載なし"
+
+# 出力形式
+TARGETS = ('notion', 'notion_table', 'text', 'markdown', 'html')
+
+def day_key(day_info):
+    """1日分のデータをキャッシュのキー（ハッシュ可能なタプル）に変換"""
+    return (
+        day_info['day'],
+        day_info['weekday'],
+        tuple(day_info['am_doctors']),
+        tuple(day_info['pm_doctors']),
+    )
+
+@lru_cache(maxsize=4096)
+def _day_labels(key):
+    """全形式で共有する1日分の表示文字列（日付, AM, PM）"""
+    day, weekday, am_doctors, pm_doctors = key
+    am_text = "、".join(am_doctors) if am_doctors else NO_ENTRY
+    pm_text = "、".join(pm_doctors) if pm_doctors else NO_ENTRY
+    return f"{day}日（{weekday}）", am_text, pm_text
+
+def _rich_text(content):
+    if not content:
+        return []
+    return [{"type": "text", "text": {"content": content}}]
+
+def _paragraph(content):
+    return {
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {"rich_text": _rich_text(content)}
+    }
+
+def _heading(content, level=2):
+    heading_type = f"heading_{level}"
+    return {
+        "object": "block",
+        "type": heading_type,
+        heading_type: {"rich_text": _rich_text(content)}
+    }
+
+def _escape_markdown(text):
+    return text.replace('|', '\\|')
+
+@lru_cache(maxsize=4096)
+def _render_day(target, key):
+    """1日分のフラグメントを生成（形式ごとにキャッシュ）
+
+    Notionブロックはキャッシュ間で共有されるため、呼び出し側で変更しないこと
+    """
+    label, am_text, pm_text = _day_labels(key)
+
+    if target == 'notion':
+        return (
+            _paragraph(label),
+            _paragraph(f"AM：{am_text}"),
+            _paragraph(f"PM：{pm_text}"),
+            _paragraph(""),
+        )
+    if target == 'notion_table':
+        return ({
+            "object": "block",
+            "type": "table_row",
+            "table_row": {"cells": [_rich_text(label), _rich_text(am_text), _rich_text(pm_text)]}
+        },)
+    if target == 'text':
+        return (label, f"AM：{am_text}", f"PM：{pm_text}", "")
+    if target == 'markdown':
+        cells = (_escape_markdown(text) for text in (label, am_text, pm_text))
+        return ("| " + " | ".join(cells) + " |",)
+    if target == 'html':
+        cells = "".join(f"<td>{html.escape(text)}</td>" for text in (label, am_text, pm_text))
+        return (f"<tr>{cells}</tr>",)
+
+    raise ValueError(f"未対応の出力形式です: {target}")
+
+def _sorted_days(calendar):
+    return sorted(calendar['data'], key=lambda x: x['day'])
+
+def render_title(title, target):
+    """カレンダーのタイトルを描画"""
+    if target == 'notion':
+        return [_paragraph(f"🗓️ {title}"), _paragraph("")]
+    if target == 'notion_table':
+        return [_heading(f"🗓️ {title}")]
+    if target == 'text':
+        return [f"🗓️ {title}", ""]
+    if target == 'markdown':
+        return [f"## 🗓️ {_escape_markdown(title)}", ""]
+    if target == 'html':
+        return [f"<h2>🗓️ {html.escape(title)}</h2>"]
+
+    raise ValueError(f"未対応の出力形式です: {target}")
+
+def render_month_body(calendar, target):
+    """1か月分の本文（タイトルを除く）を描画"""
+    fragments = []
+    for day_info in _sorted_days(calendar):
+        fragments.extend(_render_day(target, day_key(day_info)))
+
+    if target == 'notion_table':
+        return [{
+            "object": "block",
+            "type": "table",
+            "table": {
+                "table_width": 3,
+                "has_column_header": True,
+                "has_row_header": False,
+                "children": [{
+                    "object": "block",
+                    "type": "table_row",
+                    "table_row": {"cells": [_rich_text("日付"), _rich_text("AM"), _rich_text("PM")]}
+                }] + fragments
+            }
+        }]
+    if target == 'markdown':
+        return ["| 日付 | AM | PM |", "| --- | --- | --- |"] + fragments + [""]
+    if target == 'html':
+        return (["<table>", "<tr><th>日付</th><th>AM</th><th>PM</th></tr>"]
+                + fragments + ["</table>"])
+
+    return fragments
+
+def render_calendar(calendar, target):
+    """1か月分（タイトル + 本文）を描画"""
+    return render_title(calendar['title'], target) + render_month_body(calendar, target)
+
+def render_document(calendar_info, target='text'):
+    """全カレンダーを文字列として描画（text / markdown / html）"""
+    lines = []
+    for calendar in calendar_info:
+        lines.extend(render_calendar(calendar, target))
+
+    if target == 'html':
+        body = "\n".join(lines)
+        return (
+            "<!DOCTYPE html>\n<html lang=\"ja\">\n<head>\n<meta charset=\"utf-8\">\n"
+            "<title>診療担当医表</title>\n</head>\n<body>\n"
+            f"{body}\n</body>\n</html>\n"
+        )
+    return "\n".join(lines)
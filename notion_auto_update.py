@@ -8,26 +8,165 @@
 import requests
 from bs4 import BeautifulSoup
 import re
+import hashlib
 import json
 import os
+import argparse
+import concurrent.futures
+import functools
+import itertools
+import queue
+import threading
+import time
 from datetime import datetime
 import logging
 
-# ログ設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('notion_update.log'),
-        logging.StreamHandler()
-    ]
-)
+from calendar_parser import CALENDAR_URL, stream_calendar_info
+from calendar_renderer import render_calendar, render_month_body
+from schedule_fingerprint import (combine_fingerprints, fingerprint_calendar, fingerprint_schedule, load_state,
+                                  save_fingerprints)
+from run_deadline import DeadlineExceeded, RunDeadline
+from source_cache import SnapshotWriter, load_snapshot, save_snapshot
+from run_profiler import profile_iter, profiled, run_profiled, stage
+from source_fetcher import SourceFetcher, parse_source_spec, tag_calendars
+
+# Notion APIの制限（1回の追加は100ブロックまで）を考慮したバッチサイズ
+APPEND_BATCH_SIZE = 95
+
+# Notion APIの平均リクエスト上限（約3回/秒）に合わせたリクエスト間隔（秒）
+NOTION_REQUEST_INTERVAL = 0.34
+
+# 月ごとの並列追加数の上限
+MAX_PARALLEL_MONTHS = 4
+
+# 取得がこの秒数を超えたら前回のスナップショットを使う（キャッシュ使用時）
+STALE_AFTER_SECONDS = 10
+
+# ページの削除・書き込みを始めるのに必要な残り時間（秒）。不足していればページを変更しない
+MIN_WRITE_BUDGET = 60
+
+# 締め切りが短い場合は、締め切りのこの割合を書き込みに必要な残り時間とする
+WRITE_BUDGET_RATIO = 0.5
+
+# 書き込みに失敗した場合に、追加したブロックを削除して元に戻すための猶予（秒）。締め切りを過ぎていても使う
+ROLLBACK_TIMEOUT = 30
+
+# 取得元の指定がない場合の取得元
+DEFAULT_SOURCES = [{'name': '明石整形外科病院', 'url': CALENDAR_URL}]
+
+def setup_logging():
+    """ログ設定（ファイルと標準エラー出力）
+    
+    解析処理だけを使うスクリプト（ICS出力・バックフィルなど）がログファイルを作らないよう、import 時には設定しない
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('notion_update.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+def block_digest(block):
+    """ブロックの種類と表示テキストのダイジェスト（作成時の形式・一覧取得の形式の両方に対応）"""
+    block_type = block.get('type')
+    content = block.get(block_type) or {}
+    if block_type == 'table':
+        # テーブルの行は子ブロックのため、一覧には列数だけが含まれる
+        text = str(content.get('table_width'))
+    else:
+        text = ''.join(
+            rich_text.get('plain_text') or rich_text.get('text', {}).get('content', '')
+            for rich_text in content.get('rich_text', [])
+        )
+    return hashlib.sha1(f"{block_type}\x1f{text}".encode('utf-8')).hexdigest()
+
+def rolling_checksums(digests):
+    """先頭からの累積チェックサム（i番目は先頭から i+1 ブロックまでの内容を表す）"""
+    checksums = []
+    checksum = ''
+    for digest in digests:
+        checksum = hashlib.sha1(f"{checksum}{digest}".encode('utf-8')).hexdigest()
+        checksums.append(checksum)
+    return checksums
+
+class CalendarFetchError(Exception):
+    """カレンダーの取得・抽出に失敗した"""
+
+class PrefetchIterator:
+    """別スレッドでイテレータを先読みする（解析とNotionへの送信を並行させる）"""
+    _ITEM, _DONE, _ERROR = range(3)
+
+    def __init__(self, iterable):
+        self._queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, args=(iterable,), name='prefetch', daemon=True)
+        self.thread.start()
+
+    def _run(self, iterable):
+        try:
+            for item in iterable:
+                self._queue.put((self._ITEM, item))
+            self._queue.put((self._DONE, None))
+        except BaseException as e:
+            self._queue.put((self._ERROR, e))
+
+    def get(self, timeout=None):
+        """次の要素を返す（終了時は StopIteration、timeout 超過時は queue.Empty を送出）"""
+        kind, value = self._queue.get(timeout=timeout)
+        if kind == self._DONE:
+            self._queue.put((kind, value))
+            raise StopIteration
+        if kind == self._ERROR:
+            raise value
+        return value
+
+    def drain(self, timeout=None):
+        """残りの要素をすべて返す（timeout 秒以内に終わらなければ queue.Empty を送出）"""
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        items = []
+        while True:
+            try:
+                items.append(self.get(None if expires_at is None else max(0.0, expires_at - time.monotonic())))
+            except StopIteration:
+                return items
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
 
 class NotionCalendarUpdater:
-    def __init__(self, notion_token, page_id):
+    def __init__(self, notion_token, page_id, streaming=False, month_blocks=False, notion_table=False,
+                 force=False, run_timeout=None, use_cache=False, stale_after=STALE_AFTER_SECONDS, sources=None):
         """Notion API設定"""
         self.notion_token = notion_token
         self.page_id = page_id
+        # 取得元（[{'name', 'url'}]）。複数あれば並列に取得し、取得元の順にまとめる
+        self.sources = sources or DEFAULT_SOURCES
+        self.source_url = self.sources[0]['url']
+        self.streaming = streaming
+        self.month_blocks = month_blocks
+        # スケジュールに変更がなくてもNotionページを書き直すか
+        self.force = force
+        # 実行全体の締め切り（秒）。run_update の開始時に計測を始める
+        self.run_timeout = run_timeout
+        self.deadline = RunDeadline(run_timeout)
+        # 書き込みを始めるのに必要な残り時間（短い締め切りでも書き込めるよう締め切りから計算）
+        self.write_budget = min(MIN_WRITE_BUDGET, run_timeout * WRITE_BUDGET_RATIO) if run_timeout else MIN_WRITE_BUDGET
+        # 最終成功スナップショットを保存し、取得の失敗・遅延時に使うか
+        self.use_cache = use_cache
+        self.stale_after = stale_after
+        self._revalidation = None
+        # 描画形式（notion: 段落ブロック, notion_table: 見出し + テーブル）
+        self.render_target = 'notion_table' if notion_table else 'notion'
+        self._request_lock = threading.Lock()
+        self._last_request_at = 0.0
+        # 直前の書き込みでページ直下に追加したブロックと、その子として本文を追加した月（なければ None）
+        self.written_blocks = []
+        # 直前の書き込みでページ直下に作成されたブロック（失敗時に削除して元に戻す）
+        self.created_blocks = []
         self.headers = {
             "Authorization": f"Bearer {notion_token}",
             "Content-Type": "application/json",
@@ -36,20 +175,23 @@ class NotionCalendarUpdater:
         
     def get_calendar_data(self):
         """Webページからカレンダーデータを取得"""
-        url = 'https://www.myseikei.jp/information/'
+        url = self.source_url
         
         try:
-            response = requests.get(url)
-            response.encoding = response.apparent_encoding
-            html = response.text
+            with stage("http:ページ取得"):
+                response = requests.get(url, timeout=self.deadline.timeout("ページ取得"))
+                response.encoding = response.apparent_encoding
+                html = response.text
             
-            soup = BeautifulSoup(html, 'html.parser')
+            with stage("解析:HTML"):
+                soup = BeautifulSoup(html, 'html.parser')
             return soup
             
         except Exception as e:
             logging.error(f"Webページの取得に失敗しました: {e}")
             return None
 
+    @profiled("解析:HTML")
     def extract_calendar_info(self, soup):
         """カレンダー情報を抽出"""
         calendars = []
@@ -71,6 +213,7 @@ class NotionCalendarUpdater:
         
         return calendars
 
+    @profiled("解析:テーブル")
     def parse_calendar_table(self, table):
         """カレンダーテーブルを解析"""
         # ヘッダー行から曜日を取得
@@ -167,9 +310,9 @@ class NotionCalendarUpdater:
                             am_doctors.extend(doctors)
                             pm_doctors.extend(doctors)
                 
-                # 重複を除去
-                am_doctors = list(set(am_doctors))
-                pm_doctors = list(set(pm_doctors))
+                # 重複を除去（記載順を保持）
+                am_doctors = list(dict.fromkeys(am_doctors))
+                pm_doctors = list(dict.fromkeys(pm_doctors))
                 
                 # 結果を格納
                 calendar_data.append({
@@ -225,56 +368,19 @@ class NotionCalendarUpdater:
         
         return doctors
 
-    def format_calendar_for_notion(self, calendar_info):
-        """Notion用フォーマットで整形"""
-        output_lines = []
-        
-        for calendar in calendar_info:
-            title = calendar['title']
-            data = calendar['data']
-            
-            # タイトルを整形
-            output_lines.append(f"🗓️ {title}")
-            output_lines.append("")
-            
-            # 日付順にソート
-            data.sort(key=lambda x: x['day'])
-            
-            # 各日付の情報を出力
-            for day_info in data:
-                day = day_info['day']
-                weekday = day_info['weekday']
-                am_doctors = day_info['am_doctors']
-                pm_doctors = day_info['pm_doctors']
-                
-                output_lines.append(f"{day}日（{weekday}）")
-                
-                # AM担当医
-                if am_doctors:
-                    am_text = "、".join(am_doctors)
-                    output_lines.append(f"AM：{am_text}")
-                else:
-                    output_lines.append("AM：記載なし")
-                
-                # PM担当医
-                if pm_doctors:
-                    pm_text = "、".join(pm_doctors)
-                    output_lines.append(f"PM：{pm_text}")
-                else:
-                    output_lines.append("PM：記載なし")
-                
-                output_lines.append("")
-        
-        return "\n".join(output_lines)
-
     def get_page_blocks(self):
-        """Notionページの既存ブロックを取得（ページネーション対応）"""
+        """Notionページの既存ブロックを取得（ページネーション対応、失敗時は None）"""
         url = f"https://api.notion.com/v1/blocks/{self.page_id}/children"
         all_blocks = []
         
         try:
             while url:
-                response = requests.get(url, headers=self.headers)
+                with stage("http:Notion一覧取得"):
+                    response = requests.get(
+                        url, 
+                        headers=self.headers, 
+                        timeout=self.deadline.timeout("ブロック一覧取得")
+                    )
                 if response.status_code == 200:
                     data = response.json()
                     blocks = data.get('results', [])
@@ -287,162 +393,108 @@ class NotionCalendarUpdater:
                         url = None
                 else:
                     logging.error(f"ページブロック取得エラー: {response.status_code}")
-                    break
+                    return None
             
             logging.info(f"取得したブロック数: {len(all_blocks)}")
             return all_blocks
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"ページブロック取得エラー: {e}")
-            return []
+            return None
 
-    def clear_page_content(self):
-        """Notionページの内容を完全にクリア（質と速度を両立）"""
-        logging.info("既存のページ内容を完全に削除中...")
+    def archive_blocks(self, blocks, deadline=None):
+        """ブロックをアーカイブ（バッチごとに並列）し、成功した数を返す
         
-        # ページの全ブロックを取得
-        blocks = self.get_page_blocks()
+        deadline を指定した場合は実行全体の締め切りの代わりに使う
+        """
+        deadline = deadline or self.deadline
         
-        if not blocks:
-            logging.info("削除するブロックがありません")
-            return True
-        
-        logging.info(f"削除対象ブロック数: {len(blocks)}")
-        
-        # 段階的削除アプローチ
-        max_retries = 3
-        archived_count = 0
+        # バッチ削除（API制限を考慮）
+        batch_size = 20  # 安全なバッチサイズ
+        success_count = 0
         
-        for attempt in range(max_retries):
-            logging.info(f"削除試行 {attempt + 1}/{max_retries}")
-            
-            # 現在のブロックを再取得（前回の削除で残ったもの）
-            current_blocks = self.get_page_blocks()
-            if not current_blocks:
-                logging.info("すべてのブロックが削除されました")
-                break
-            
-            logging.info(f"残りブロック数: {len(current_blocks)}")
-            
-            # バッチ削除（API制限を考慮）
-            batch_size = 20  # 安全なバッチサイズ
-            success_count = 0
-            
-            for i in range(0, len(current_blocks), batch_size):
-                batch = current_blocks[i:i + batch_size]
-                
-                # バッチ内のブロックを並列削除
-                import concurrent.futures
-                import time
-                
-                def archive_block(block):
-                    block_id = block['id']
-                    archive_url = f"https://api.notion.com/v1/blocks/{block_id}"
-                    
-                    try:
-                        response = requests.patch(
-                            archive_url, 
-                            headers=self.headers, 
-                            json={"archived": True}
-                        )
-                        return response.status_code == 200, block_id
-                    except Exception as e:
-                        logging.error(f"ブロックアーカイブエラー: {e}, ブロックID: {block_id}")
-                        return False, block_id
-                
-                # 並列処理でバッチ削除
-                with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                    futures = [executor.submit(archive_block, block) for block in batch]
-                    
-                    for future in concurrent.futures.as_completed(futures):
-                        success, block_id = future.result()
-                        if success:
-                            success_count += 1
-                
-                logging.info(f"バッチ削除完了: {success_count}/{len(current_blocks)}")
-                
-                # API制限を考慮して待機
-                time.sleep(0.3)
-            
-            archived_count += success_count
-            
-            # 削除が完了したかチェック
-            remaining_blocks = self.get_page_blocks()
-            if not remaining_blocks:
-                logging.info(f"削除完了: 合計 {archived_count} ブロックを削除")
-                break
-            
-            logging.info(f"削除後残りブロック数: {len(remaining_blocks)}")
+        # バッチ内のブロックを並列削除
+        def archive_block(block):
+            block_id = block['id']
+            archive_url = f"https://api.notion.com/v1/blocks/{block_id}"
             
-            # 次の試行まで少し待機
-            if attempt < max_retries - 1:
-                time.sleep(1)
-        
-        # 最終確認
-        final_blocks = self.get_page_blocks()
-        if final_blocks:
-            logging.warning(f"削除できなかったブロック数: {len(final_blocks)}")
-            # 個別に削除を試行
-            for block in final_blocks:
-                try:
-                    block_id = block['id']
-                    archive_url = f"https://api.notion.com/v1/blocks/{block_id}"
+            try:
+                with stage("http:Notion削除"):
                     response = requests.patch(
                         archive_url, 
                         headers=self.headers, 
-                        json={"archived": True}
+                        json={"archived": True},
+                        timeout=deadline.timeout("ブロック削除")
                     )
-                    if response.status_code == 200:
-                        logging.info(f"個別削除成功: {block_id}")
-                    else:
-                        logging.error(f"個別削除失敗: {block_id}, ステータス: {response.status_code}")
-                except Exception as e:
-                    logging.error(f"個別削除エラー: {e}")
-        else:
-            logging.info("✅ すべてのブロックが正常に削除されました")
+                if response.status_code != 200:
+                    logging.error(f"ブロックアーカイブエラー: {response.status_code}, ブロックID: {block_id}")
+                return response.status_code == 200, block_id
+            except DeadlineExceeded:
+                return False, block_id
+            except Exception as e:
+                logging.error(f"ブロックアーカイブエラー: {e}, ブロックID: {block_id}")
+                return False, block_id
         
-        # 削除完了後の待機
-        import time
-        time.sleep(2)
+        for i in range(0, len(blocks), batch_size):
+            batch = blocks[i:i + batch_size]
+            
+            # 締め切りを過ぎていればバッチの間で中断
+            deadline.check("ブロック削除")
+            
+            # 並列処理でバッチ削除
+            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+                futures = [executor.submit(archive_block, block) for block in batch]
+                
+                for future in concurrent.futures.as_completed(futures):
+                    success, block_id = future.result()
+                    if success:
+                        success_count += 1
+            
+            logging.info(f"バッチ削除完了: {success_count}/{len(blocks)}")
+            
+            # API制限を考慮して待機
+            if i + batch_size < len(blocks):
+                deadline.sleep(0.3)
         
-        return True
+        return success_count
 
-    def update_page_content(self, content):
-        """Notionページに新しいコンテンツを追加（バッチ処理対応）"""
-        url = f"https://api.notion.com/v1/blocks/{self.page_id}/children"
+    def remove_previous_blocks(self, blocks):
+        """新しい内容を書き終えた後、前回の内容のブロックを削除
         
-        # コンテンツを行ごとに分割
-        lines = content.split('\n')
-        
-        # Notionブロック形式に変換
-        blocks = []
-        for line in lines:
-            if line.strip():
-                blocks.append({
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{
-                            "type": "text",
-                            "text": {"content": line}
-                        }]
-                    }
-                })
-            else:
-                # 空行の場合は改行ブロック
-                blocks.append({
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": []
-                    }
-                })
+        削除しきれなかったブロックは書き込み後の検証で取り除く
+        """
+        if not blocks:
+            return
         
-        # 更新日時を追加（日本時間）
+        logging.info(f"前回の内容を削除中: {len(blocks)} ブロック")
+        archived_count = self.archive_blocks(blocks)
+        
+        if archived_count < len(blocks):
+            logging.warning(f"削除できなかったブロック数: {len(blocks) - archived_count}（書き込み後の検証で削除します）")
+        else:
+            logging.info(f"削除完了: 合計 {archived_count} ブロックを削除")
+
+    def discard_created_blocks(self):
+        """書き込みに失敗した場合、今回追加したブロックを削除して前回の内容に戻す"""
+        blocks = self.created_blocks
+        self.created_blocks = []
+        if not blocks:
+            return
+        
+        logging.warning(f"書き込みに失敗したため、今回追加した {len(blocks)} ブロックを削除して前回の内容に戻します")
+        # 締め切りを過ぎて中断した場合も元に戻せるよう、短い猶予で削除する
+        archived_count = self.archive_blocks(blocks, deadline=RunDeadline(ROLLBACK_TIMEOUT))
+        if archived_count < len(blocks):
+            logging.error(f"今回追加したブロックのうち {len(blocks) - archived_count} 個を削除できませんでした（次回の実行で書き直します）")
+
+    def update_time_block(self):
+        """更新日時ブロックを作成（日本時間）"""
         import pytz
         jst = pytz.timezone('Asia/Tokyo')
         update_time = datetime.now(jst).strftime("%Y年%m月%d日 %H:%M 更新")
-        blocks.insert(0, {
+        return {
             "object": "block",
             "type": "paragraph",
             "paragraph": {
@@ -451,84 +503,600 @@ class NotionCalendarUpdater:
                     "text": {"content": f"🔄 {update_time}"}
                 }]
             }
-        })
+        }
+
+    def _throttle(self):
+        """スレッド間で共有するリクエスト間隔の制御"""
+        with self._request_lock:
+            wait = self._last_request_at + NOTION_REQUEST_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request_at = time.monotonic()
+
+    def append_children(self, parent_id, blocks, label="", after=None, created=None):
+        """親ブロックの末尾（after を指定した場合はそのブロックの後ろ）に子ブロックを追加（バッチ処理対応）
         
-        # Notion APIの制限（100ブロック）を考慮してバッチ処理
-        batch_size = 95  # 安全マージンを考慮
-        success_count = 0
+        blocks はジェネレータでもよく、バッチが埋まるたびに送信する
+        成功時は作成されたブロックのリスト、失敗時は None を返す
+        created を指定した場合は、途中で失敗しても作成済みのブロックがそのリストに残る
+        """
+        url = f"https://api.notion.com/v1/blocks/{parent_id}/children"
+        created = [] if created is None else created
+        blocks = iter(blocks)
         
         try:
-            for i in range(0, len(blocks), batch_size):
-                batch = blocks[i:i + batch_size]
+            for batch_number in itertools.count(1):
+                batch = list(itertools.islice(blocks, APPEND_BATCH_SIZE))
+                if not batch:
+                    break
                 
-                response = requests.patch(
-                    url, 
-                    headers=self.headers, 
-                    json={"children": batch}
-                )
+                # 締め切りを過ぎていればバッチの間で中断
+                self.deadline.check("ブロック追加")
+                
+                with stage("待機:レート制限"):
+                    self._throttle()
+                payload = {"children": batch}
+                if after:
+                    payload["after"] = after
+                with stage("http:Notion追加"):
+                    response = requests.patch(
+                        url, 
+                        headers=self.headers, 
+                        json=payload,
+                        timeout=self.deadline.timeout("ブロック追加")
+                    )
                 
                 if response.status_code == 200:
-                    success_count += len(batch)
-                    logging.info(f"バッチ {i//batch_size + 1}: {len(batch)}ブロックを追加しました")
+                    results = response.json().get('results', [])
+                    created.extend(results)
+                    # 次のバッチは今回追加したブロックの後ろに続ける
+                    if after and results:
+                        after = results[-1]['id']
+                    logging.info(f"{label}バッチ {batch_number}: {len(batch)}ブロックを追加しました")
                 else:
-                    logging.error(f"バッチ {i//batch_size + 1} エラー: {response.status_code}")
+                    logging.error(f"{label}バッチ {batch_number} エラー: {response.status_code}")
                     logging.error(f"レスポンス: {response.text}")
-                    return False
+                    return None
             
-            logging.info(f"合計 {success_count} ブロックを正常に追加しました")
-            return True
+            return created
                 
+        except (DeadlineExceeded, CalendarFetchError):
+            raise
         except Exception as e:
-            logging.error(f"ページ更新エラー: {e}")
+            logging.error(f"{label}ページ更新エラー: {e}")
+            return None
+
+    def update_page_content(self, months):
+        """Notionページの末尾に新しいブロックを追加（届いた月から1か月ずつ描画しながらバッチ送信）"""
+        self.written_blocks = []
+        self.created_blocks = []
+        
+        def blocks():
+            # 更新日時を追加
+            yield self.update_time_block()
+            for calendar in months:
+                with stage("描画"):
+                    blocks = render_calendar(calendar, self.render_target)
+                yield from blocks
+        
+        def recorded(blocks):
+            for block in blocks:
+                self.written_blocks.append((block, None))
+                yield block
+        
+        created = self.append_children(self.page_id, recorded(blocks()), created=self.created_blocks)
+        if created is None:
             return False
+        
+        logging.info(f"合計 {len(created)} ブロックを正常に追加しました")
+        return True
+
+    def update_page_by_month(self, months):
+        """月ごとの親ブロックを作成し、各月の本文を並列に追加
+        
+        更新日時と全月の見出しは1回の順序付きリクエストで作成し、本文は見出しの子ブロックとして並列に追加する
+        （見出しをまとめて作成するため、全月の取得・解析を待ってから書き込む）
+        """
+        months = list(months)
+        time_block = self.update_time_block()
+        headings = [{
+            "object": "block",
+            "type": "heading_2",
+            "heading_2": {
+                "rich_text": [{
+                    "type": "text",
+                    "text": {"content": f"🗓️ {calendar['title']}"}
+                }],
+                "is_toggleable": True
+            }
+        } for calendar in months]
+        
+        self.written_blocks = [(time_block, None)] + list(zip(headings, months))
+        self.created_blocks = []
+        created = self.append_children(
+            self.page_id, [time_block] + headings, label="更新日時・見出し", created=self.created_blocks
+        )
+        if created is None or len(created) != len(headings) + 1:
+            logging.error("見出しブロックを作成できませんでした")
+            return False
+        
+        def append_month(parent_id, calendar):
+            with stage("描画"):
+                blocks = render_month_body(calendar, self.render_target)
+            result = self.append_children(parent_id, blocks, label=f"{calendar['title']} ")
+            return calendar['title'], result, len(blocks)
+        
+        success = True
+        total_count = len(created)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL_MONTHS) as executor:
+            futures = [
+                executor.submit(append_month, heading['id'], calendar)
+                for heading, calendar in zip(created[1:], months)
+            ]
+            
+            for future in concurrent.futures.as_completed(futures):
+                title, result, block_count = future.result()
+                if result is None:
+                    logging.error(f"{title} の追加に失敗しました")
+                    success = False
+                else:
+                    total_count += block_count
+        
+        if success:
+            logging.info(f"合計 {total_count} ブロックを正常に追加しました")
+        return success
+
+    def insert_blocks(self, entries, after=None):
+        """ページ直下のブロックの後ろ（after=None の場合は末尾）にブロックを挿入し、月の本文も追加
+        
+        entries: [(ブロック, 子として本文を追加する月 または None)]
+        """
+        created = self.append_children(self.page_id, [block for block, _ in entries], label="修復", after=after)
+        if created is None or len(created) != len(entries):
+            return False
+        
+        for (_, calendar), block in zip(entries, created):
+            if calendar is None:
+                continue
+            body = render_month_body(calendar, self.render_target)
+            if self.append_children(block['id'], body, label=f"{calendar['title']} ") is None:
+                return False
+        return True
+
+    def verify_page_content(self):
+        """書き込み後のページを1回の一覧取得で検証し、食い違った範囲だけを修復
+        
+        ページ直下のブロックの累積チェックサムを書き込んだ内容と比較する
+        （月ごとの本文・テーブルの行は子ブロックのため、追加時のレスポンスで確認済みとする）
+        """
+        intended = self.written_blocks
+        with stage("検証"):
+            actual = self.get_page_blocks()
+        if actual is None:
+            # 検証できない内容を正しいものとして記録しない（次回の実行で書き直す）
+            logging.error("ページの一覧を取得できなかったため、書き込み結果を検証できませんでした")
+            return False
+        
+        actual_digests = [block_digest(block) for block in actual]
+        intended_digests = [block_digest(block) for block, _ in intended]
+        actual_checksums = rolling_checksums(actual_digests)
+        intended_checksums = rolling_checksums(intended_digests)
+        
+        if len(actual) == len(intended) and actual_checksums[-1:] == intended_checksums[-1:]:
+            logging.info(f"✅ ページの内容を検証しました（{len(actual)} ブロック）")
+            return True
+        
+        # 先頭・末尾から一致する範囲を除いた部分が食い違っている
+        prefix = 0
+        for actual_checksum, intended_checksum in zip(actual_checksums, intended_checksums):
+            if actual_checksum != intended_checksum:
+                break
+            prefix += 1
+        
+        limit = min(len(actual), len(intended)) - prefix
+        suffix = 0
+        while suffix < limit and actual_digests[-1 - suffix] == intended_digests[-1 - suffix]:
+            suffix += 1
+        
+        extra = actual[prefix:len(actual) - suffix]
+        missing = intended[prefix:len(intended) - suffix]
+        logging.warning(
+            f"ページの内容が書き込んだ内容と一致しません（{prefix + 1}番目から 余分 {len(extra)}・不足 {len(missing)} ブロック）"
+        )
+        
+        anchor = actual[prefix - 1]['id'] if prefix else None
+        if missing and not prefix:
+            # 先頭には挿入できないため、ページ全体を書き直す
+            logging.warning("先頭のブロックが食い違っているため、ページ全体を書き直します")
+            extra, missing = actual, intended
+        
+        with stage("修復"):
+            if extra and self.archive_blocks(extra) < len(extra):
+                logging.error("余分なブロックを削除できませんでした")
+                return False
+            if missing and not self.insert_blocks(missing, after=anchor):
+                logging.error("不足しているブロックを追加できませんでした")
+                return False
+        
+        logging.info(f"食い違った範囲を修復しました（削除 {len(extra)}・追加 {len(missing)} ブロック）")
+        return True
+
+    def state_key(self):
+        """フィンガープリント保存用のキー（ページと表示形式ごと）"""
+        layout = 'month' if self.month_blocks else 'flat'
+        return f"notion:{self.page_id}:{self.render_target}:{layout}"
+
+    def iter_calendars(self):
+        """取得したページからカレンダー（見出し + テーブル）を順に返す"""
+        if self.streaming:
+            # ストリーミング取得しながらテーブルを読み終えるたびに返す
+            try:
+                for calendar in stream_calendar_info(self.source_url, deadline=self.deadline):
+                    logging.info(f"カレンダー発見: {calendar['title']}")
+                    yield calendar
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                raise CalendarFetchError(f"Webページの取得に失敗しました: {e}") from e
+        else:
+            # カレンダーデータを取得
+            soup = self.get_calendar_data()
+            if not soup:
+                raise CalendarFetchError("カレンダーデータの取得に失敗しました")
+            
+            # カレンダー情報を抽出
+            yield from self.extract_calendar_info(soup)
+
+    def iter_calendar_info(self):
+        """カレンダーを1か月ずつ解析して返す（最後まで読み終えたらスナップショットを保存）
+        
+        スナップショットは1か月ずつ一時ファイルに書き出し、ページ全体をメモリに保持しない
+        """
+        writer = None
+        if self.use_cache:
+            try:
+                writer = SnapshotWriter(self.source_url)
+            except OSError as e:
+                logging.warning(f"スナップショットを保存できませんでした: {e}")
+        count = 0
+        
+        try:
+            for calendar in self.iter_calendars():
+                count += 1
+                logging.info(f"解析中: {calendar['title']}")
+                month = {
+                    'title': calendar['title'],
+                    'data': self.parse_calendar_table(calendar['table'])
+                }
+                
+                if writer:
+                    try:
+                        writer.add(calendar['title'], str(calendar['table']), month)
+                    except OSError as e:
+                        logging.warning(f"スナップショットを保存できませんでした: {e}")
+                        writer.discard()
+                        writer = None
+                yield month
+            
+            if not count:
+                raise CalendarFetchError("カレンダーが見つかりませんでした")
+            
+            if writer:
+                try:
+                    writer.commit()
+                except OSError as e:
+                    logging.warning(f"スナップショットを保存できませんでした: {e}")
+                    writer.discard()
+                writer = None
+        finally:
+            # 途中で失敗した場合は前回のスナップショットを残す
+            if writer:
+                writer.discard()
+
+    def iter_months(self):
+        """解析済みのカレンダーを1か月ずつ返す（取得の失敗・遅延時は前回のスナップショット）
+        
+        取得と解析は別スレッドで先行させ、呼び出し側のNotionへの送信と並行して進める
+        """
+        if len(self.sources) > 1:
+            yield from self.iter_source_months()
+            return
+        
+        snapshot = load_snapshot(self.source_url) if self.use_cache else None
+        feed = PrefetchIterator(self.iter_calendar_info())
+        
+        try:
+            # スナップショットがあれば最初の1か月を stale_after 秒だけ待つ
+            first = feed.get(timeout=self.stale_after if snapshot else None)
+        except StopIteration:
+            return
+        except queue.Empty:
+            # 取得はバックグラウンドで継続し、締め切りまでに完了すれば最新の内容で書き直す
+            logging.warning(
+                f"取得が{self.stale_after}秒を超えたため、前回のスナップショット（{snapshot['age'] / 3600:.1f}時間前）を使用します"
+                "（取得はバックグラウンドで継続し、締め切りまでに完了すれば最新の内容に更新します）"
+            )
+            yield from snapshot['calendar_info']
+            self._revalidation = feed.drain
+            return
+        except (CalendarFetchError, requests.RequestException) as e:
+            if not snapshot:
+                raise
+            logging.error(str(e))
+            logging.warning(f"取得に失敗したため、前回のスナップショット（{snapshot['age'] / 3600:.1f}時間前）を使用します")
+            yield from snapshot['calendar_info']
+            return
+        
+        yield first
+        yield from profile_iter("待機:解析結果", feed)
+
+    def iter_source_months(self):
+        """複数の取得元を並列に取得・解析し、取得元の順に1か月ずつ返す
+        
+        取得元ごとに、失敗・遅延時は前回のスナップショットを使う
+        """
+        fetcher = SourceFetcher(deadline=self.deadline)
+        futures = fetcher.submit_all(self.sources, parse_source_page)
+        started = time.monotonic()
+        # 取得元ごとの (取得元, 使った解析結果, 遅延してスナップショットを使った場合の Future)
+        used = []
+        completed = False
+        
+        if self.use_cache:
+            # 遅れて完了した取得もスナップショットに反映する
+            for source, future in zip(self.sources, futures):
+                future.add_done_callback(lambda done, url=source['url']: self._save_source_snapshot(url, done))
+        
+        try:
+            for source, future in zip(self.sources, futures):
+                snapshot = load_snapshot(source['url']) if self.use_cache else None
+                timeout = max(0.0, started + self.stale_after - time.monotonic()) if snapshot else None
+                
+                stale_future = None
+                try:
+                    with stage("待機:取得元"):
+                        _, calendar_info = future.result(timeout=timeout)
+                except concurrent.futures.TimeoutError:
+                    logging.warning(
+                        f"{source['name']} の取得が{self.stale_after}秒を超えたため、"
+                        f"前回のスナップショット（{snapshot['age'] / 3600:.1f}時間前）を使用します"
+                    )
+                    calendar_info = snapshot['calendar_info']
+                    stale_future = future
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    if not snapshot:
+                        raise CalendarFetchError(f"{source['name']} の取得に失敗しました: {e}") from e
+                    logging.error(f"{source['name']} の取得に失敗しました: {e}")
+                    logging.warning(f"前回のスナップショット（{snapshot['age'] / 3600:.1f}時間前）を使用します")
+                    calendar_info = snapshot['calendar_info']
+                
+                if not calendar_info:
+                    raise CalendarFetchError(f"{source['name']} にカレンダーが見つかりませんでした")
+                
+                used.append((source, calendar_info, stale_future))
+                for calendar in tag_calendars(calendar_info, source, prefix_title=True):
+                    logging.info(f"カレンダー発見: {calendar['title']}")
+                    yield calendar
+            completed = True
+        finally:
+            if completed and any(stale_future for _, _, stale_future in used):
+                # 遅れている取得元は締め切りまでに完了すれば最新の内容で書き直す
+                self._revalidation = functools.partial(self._collect_sources, fetcher, used)
+            else:
+                # 実行中の取得は待たない（完了すればスナップショットが更新される）
+                fetcher.close(wait=all(future.done() for future in futures))
+    
+    def _collect_sources(self, fetcher, used, timeout=None):
+        """遅れていた取得元の結果を待ち、全取得元の最新の月のリストを返す（timeout 超過時は TimeoutError）"""
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        try:
+            months = []
+            for source, calendar_info, stale_future in used:
+                if stale_future is not None:
+                    remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+                    _, calendar_info = stale_future.result(timeout=remaining)
+                    if not calendar_info:
+                        raise CalendarFetchError(f"{source['name']} にカレンダーが見つかりませんでした")
+                months.extend(tag_calendars(calendar_info, source, prefix_title=True))
+            return months
+        finally:
+            fetcher.close(wait=all(stale_future is None or stale_future.done() for _, _, stale_future in used))
+    
+    def _save_source_snapshot(self, url, future):
+        """取得元の取得・解析が成功していればスナップショットを保存"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        html, calendar_info = future.result()
+        if not calendar_info:
+            return
+        try:
+            save_snapshot(url, html, calendar_info)
+        except OSError as e:
+            logging.warning(f"スナップショットを保存できませんでした: {e}")
+
+    def wait_for_revalidation(self, timeout=None):
+        """スナップショットを使った場合に、バックグラウンドの再取得を timeout 秒まで待つ
+        
+        完了すれば最新の月のリストを返す（再取得していない・間に合わない・失敗した場合は None）
+        """
+        collect = self._revalidation
+        self._revalidation = None
+        if collect is None:
+            return None
+        if timeout is not None and timeout <= 0:
+            logging.warning("バックグラウンドの再取得を待つ時間がありません（完了すれば次回の実行に反映します）")
+            return None
+        
+        logging.info("バックグラウンドの再取得の完了を待機中...")
+        try:
+            with stage("待機:再取得"):
+                return collect(timeout) or None
+        except (queue.Empty, concurrent.futures.TimeoutError):
+            logging.warning("バックグラウンドの再取得が締め切りまでに終わりませんでした（完了すれば次回の実行に反映します）")
+        except Exception as e:
+            logging.error(f"バックグラウンドの再取得に失敗しました: {e}")
+        return None
 
     def run_update(self):
-        """メインの更新処理"""
-        logging.info("診療カレンダー自動更新を開始します")
+        """メインの更新処理（実行全体の締め切りを管理）"""
+        self.deadline = RunDeadline(self.run_timeout)
         
-        # カレンダーデータを取得
-        soup = self.get_calendar_data()
-        if not soup:
-            logging.error("カレンダーデータの取得に失敗しました")
+        try:
+            return self._run_update()
+        except DeadlineExceeded as e:
+            logging.error(f"実行の締め切りを過ぎたため更新を中断しました: {e}")
+            return False
+        except CalendarFetchError as e:
+            logging.error(str(e))
             return False
+        finally:
+            self._revalidation = None
+
+    def _run_update(self):
+        """更新処理の本体
+        
+        取得が遅れて前回のスナップショットで更新した場合は、締め切り（書き込みに必要な時間を除く）まで
+        最新の取得結果を待ち、内容が違えば書き直す
+        """
+        logging.info("診療カレンダー自動更新を開始します")
+        
+        success, published = self.sync_months(self.iter_months())
+        
+        remaining = self.deadline.remaining()
+        fresh = self.wait_for_revalidation(None if remaining is None else remaining - self.write_budget)
+        if fresh is None:
+            return success
+        
+        if published is not None and fingerprint_schedule(fresh) == published:
+            logging.info("最新の取得結果はスナップショットと同じ内容のため、書き直しは不要です")
+            return success
         
-        # カレンダー情報を抽出
-        calendars = self.extract_calendar_info(soup)
-        if not calendars:
+        logging.info("最新の取得結果が締め切りまでに届いたため、最新の内容で更新します")
+        success, _ = self.sync_months(iter(fresh))
+        return success
+
+    def sync_months(self, months):
+        """月のイテレータでNotionページを更新し、(成功したか, ページに反映済みの内容のフィンガープリント) を返す
+        
+        取得・解析は別スレッドで先行させ、届いた月から描画してページの末尾へ送信する
+        前回の内容は新しい内容を書き終えてから削除し、途中で失敗した場合は今回追加したブロックを削除して元に戻す
+        """
+        # 流れてきた月のフィンガープリントを記録
+        fingerprints = []
+        
+        def record(months):
+            for calendar in months:
+                fingerprints.append((calendar['title'], fingerprint_calendar(calendar)))
+                yield calendar
+        
+        months = record(months)
+        
+        # 前回と同じ月は読み進めるだけにし、変わった月が見つかった時点で変更ありと判定する
+        state_key = self.state_key()
+        stored = None if self.force else load_state().get(state_key)
+        stored_calendars = stored.get('calendars', {}) if stored else {}
+        read_months = []
+        changed = stored is None
+        
+        for calendar in months:
+            read_months.append(calendar)
+            if changed or stored_calendars.get(calendar['title']) != fingerprints[-1][1]:
+                changed = True
+                break
+        
+        if not read_months:
             logging.error("カレンダーが見つかりませんでした")
-            return False
+            return False, None
         
-        # 各カレンダーを解析
-        calendar_info = []
-        for calendar in calendars:
-            logging.info(f"解析中: {calendar['title']}")
-            data = self.parse_calendar_table(calendar['table'])
-            calendar_info.append({
-                'title': calendar['title'],
-                'data': data
-            })
+        if not changed:
+            changed = (len(fingerprints) != len(stored_calendars)
+                       or combine_fingerprints(fp for _, fp in fingerprints) != stored.get('fingerprint'))
         
-        # Notion用フォーマットで整形
-        content = self.format_calendar_for_notion(calendar_info)
+        # スケジュールに変更がなければNotionへの書き込みを省略
+        if not changed:
+            logging.info("スケジュールに変更がないため、Notionページの更新をスキップしました")
+            return True, combine_fingerprints(fp for _, fp in fingerprints)
+        
+        # 書き込みに必要な残り時間がなければページを変更せずに終了
+        remaining = self.deadline.remaining()
+        if remaining is not None and remaining < self.write_budget:
+            logging.error(f"残り時間（{remaining:.0f}秒）が不足しているため、ページを変更せずに終了します")
+            return False, None
         
         # Notionページを更新
         logging.info("Notionページを更新中...")
         
-        # 既存の内容をクリア
-        self.clear_page_content()
+        # 前回の内容は新しい内容を書き終えてから削除する（一覧を取得できなければページを変更せずに終了）
+        previous_blocks = self.get_page_blocks()
+        if previous_blocks is None:
+            logging.error("ページの一覧を取得できなかったため、Notionページの更新を中止しました")
+            return False, None
+        
+        # 新しい内容を前回の内容の後ろに追加（読み進めた月 + 残りの月を、届いた順に描画しながら送信）
+        months = itertools.chain(read_months, months)
+        try:
+            if self.month_blocks:
+                success = self.update_page_by_month(months)
+            else:
+                success = self.update_page_content(months)
+        except Exception:
+            # 取得・解析の失敗や締め切りで中断した場合も、ページを前回の内容に戻す
+            self.discard_created_blocks()
+            raise
+        
+        if not success:
+            self.discard_created_blocks()
+            logging.error("Notionページの更新に失敗しました（前回の内容のまま）")
+            return False, None
         
-        # 新しい内容を追加
-        success = self.update_page_content(content)
+        self.remove_previous_blocks(previous_blocks)
+        
+        # 書き込んだ内容とページを照合し、食い違った範囲だけを修復
+        success = self.verify_page_content()
         
         if success:
+            save_fingerprints(state_key, fingerprints)
             logging.info("診療カレンダーの自動更新が完了しました")
-            return True
+            return True, combine_fingerprints(fp for _, fp in fingerprints)
         else:
             logging.error("Notionページの更新に失敗しました")
-            return False
+            return False, None
+
+def parse_source_page(html):
+    """取得したページを解析（複数取得元の並列解析でワーカープロセスから呼ばれる）"""
+    updater = NotionCalendarUpdater(None, None)
+    soup = BeautifulSoup(html, 'html.parser')
+    return [
+        {'title': calendar['title'], 'data': updater.parse_calendar_table(calendar['table'])}
+        for calendar in updater.extract_calendar_info(soup)
+    ]
 
 def main():
     """メイン処理"""
+    setup_logging()
+    parser = argparse.ArgumentParser(description='診療カレンダー Notion自動更新')
+    parser.add_argument('--stream', action='store_true',
+                        help='ページを逐次取得し、担当医表を読み終えた時点で接続を閉じる')
+    parser.add_argument('--month-blocks', action='store_true',
+                        help='月ごとに見出しブロックを作成し、各月の本文を並列に追加する')
+    parser.add_argument('--notion-table', action='store_true',
+                        help='各月を見出しとテーブルブロックで表示する')
+    parser.add_argument('--force', action='store_true',
+                        help='スケジュールに変更がなくてもNotionページを書き直す')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='前回のスナップショットを保存・使用しない')
+    parser.add_argument('--stale-after', type=float, default=STALE_AFTER_SECONDS,
+                        help='取得がこの秒数を超えたら前回のスナップショットを使う')
+    parser.add_argument('--profile', action='store_true',
+                        help='プロファイルを notion_update.prof / notion_update.stages.txt に保存する')
+    parser.add_argument('--source', action='append', default=[], metavar='[名前=]URL',
+                        help='取得元のページ（複数指定すると並列に取得して1つのページにまとめる。設定ファイルの sources より優先）')
+    parser.add_argument('--deadline', type=float, default=600,
+                        help='実行全体の締め切り（秒）。0を指定すると無効（各リクエストのタイムアウトは維持）')
+    args = parser.parse_args()
+    
     # 設定ファイルから認証情報を読み込み
     config_file = os.path.join(os.path.dirname(__file__), 'notion_config.json')
     
@@ -536,6 +1104,19 @@ def main():
     notion_token = os.getenv('NOTION_TOKEN')
     page_id = os.getenv('NOTION_PAGE_ID')
     
+    # 取得元（コマンドライン → 設定ファイルの sources の順に優先）
+    sources = [parse_source_spec(spec) for spec in args.source]
+    if not sources and os.path.exists(config_file):
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                sources = [
+                    parse_source_spec(source) if isinstance(source, str) else source
+                    for source in json.load(f).get('sources', [])
+                ]
+        except Exception as e:
+            logging.error(f"設定ファイル読み込みエラー: {e}")
+            return
+    
     # 環境変数がない場合は設定ファイルから読み込み
     if not notion_token or not page_id:
         if not os.path.exists(config_file):
@@ -559,8 +1140,16 @@ def main():
             return
     
     # Notion更新を実行
-    updater = NotionCalendarUpdater(notion_token, page_id)
-    success = updater.run_update()
+    updater = NotionCalendarUpdater(
+        notion_token, page_id, streaming=args.stream, month_blocks=args.month_blocks,
+        notion_table=args.notion_table, force=args.force,
+        run_timeout=args.deadline or None, use_cache=not args.no_cache,
+        stale_after=args.stale_after, sources=sources
+    )
+    if args.profile:
+        success = run_profiled(updater.run_update, 'notion_update')
+    else:
+        success = updater.run_update()
     
     if success:
         print("✅ 診療カレンダーの自動更新が完了しました")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+実行全体の締め切り管理
+実行開始時に締め切りを決め、各HTTPリクエストのタイムアウトを残り時間から計算します
+"""
+
+import time
+
+# 1リクエストあたりのタイムアウト上限（秒）。締め切りがなくてもこれを超えて待たない
+DEFAULT_REQUEST_TIMEOUT = 30.0
+
+# これより残り時間が短い場合は新しいリクエストを開始しない（秒）
+MIN_REQUEST_TIMEOUT = 1.0
+
+class DeadlineExceeded(Exception):
+    """実行の締め切りを過ぎた"""
+
+class RunDeadline:
+    """実行全体の締め切り（seconds が None の場合は締め切りなし）"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        """残り時間（秒）。締め切りがない場合は None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        """締め切りを過ぎたか"""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self, stage):
+        """締め切りを過ぎていれば DeadlineExceeded を送出"""
+        if self.expired():
+            raise DeadlineExceeded(f"{stage}: 実行の締め切り（{self.seconds}秒）を過ぎました")
+
+    def timeout(self, stage, limit=DEFAULT_REQUEST_TIMEOUT):
+        """次のリクエストのタイムアウト（秒）を残り時間から計算"""
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        if remaining < MIN_REQUEST_TIMEOUT:
+            raise DeadlineExceeded(f"{stage}: 実行の締め切り（{self.seconds}秒）までに残り時間がありません")
+        return min(limit, remaining)
+
+    def sleep(self, seconds):
+        """締め切りを超えない範囲で待機"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        if seconds > 0:
+            time.sleep(seconds)
+
+def request_timeout(deadline, stage):
+    """deadline が None の場合も含めてリクエストのタイムアウトを返す"""
+    if deadline is None:
+        return DEFAULT_REQUEST_TIMEOUT
+    return deadline.timeout(stage)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+更新処理のプロファイリング
+cProfile による関数単位の統計（pstats）と、ステージ単位の実時間・CPU時間を記録します
+ステージ名が "http:" で始まるものはHTTP通信、それ以外はPythonの処理として集計します
+"""
+
+import cProfile
+import functools
+import pstats
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager, nullcontext
+
+HTTP_PREFIX = 'http:'
+
+def _pad(text, width):
+    """全角文字を2桁として左寄せ"""
+    display_width = sum(2 if unicodedata.east_asian_width(char) in 'WF' else 1 for char in text)
+    return text + ' ' * max(0, width - display_width)
+
+class RunProfiler:
+    """ステージごとの実時間・CPU時間を集計（入れ子のステージは内側にだけ計上）"""
+
+    def __init__(self):
+        # ステージ名 → [呼び出し回数, 実時間, CPU時間]
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _add(self, name, calls, wall, cpu):
+        with self._lock:
+            entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += wall
+            entry[2] += cpu
+
+    @contextmanager
+    def stage(self, name):
+        """ステージの実行時間を計測"""
+        stack = self._stack()
+        wall, cpu = time.perf_counter(), time.thread_time()
+
+        # 外側のステージの計測を一時停止
+        if stack:
+            parent = stack[-1]
+            self._add(parent[0], 0, wall - parent[1], cpu - parent[2])
+
+        frame = [name, wall, cpu]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            self._add(name, 1, wall - frame[1], cpu - frame[2])
+            stack.pop()
+
+            # 外側のステージの計測を再開
+            if stack:
+                stack[-1][1] = wall
+                stack[-1][2] = cpu
+
+    def report(self, total_wall):
+        """ステージ別の集計表を作成"""
+        lines = [
+            f"実行時間（実時間）: {total_wall:.3f}秒",
+            "ステージ別の時間（入れ子のステージを除く・全スレッド合計のため並列部分は実行時間を超えることがあります）",
+            f"{_pad('ステージ', 24)}{'calls':>8}{'wall(s)':>12}{'cpu(s)':>10}{'wait(s)':>10}",
+        ]
+        http_wait = 0.0
+        python_cpu = 0.0
+        for name, (calls, wall, cpu) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            wait = max(0.0, wall - cpu)
+            lines.append(f"{_pad(name, 24)}{calls:>8}{wall:>12.3f}{cpu:>10.3f}{wait:>10.3f}")
+            if name.startswith(HTTP_PREFIX):
+                http_wait += wall
+            else:
+                python_cpu += cpu
+
+        lines.append("")
+        lines.append(f"HTTP通信の時間合計: {http_wait:.3f}秒")
+        lines.append(f"Python処理（解析・描画など）のCPU時間合計: {python_cpu:.3f}秒")
+        return "\n".join(lines)
+
+_profiler = None
+
+def stage(name):
+    """プロファイル中のみステージを計測するコンテキストマネージャ"""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.stage(name)
+
+def profiled(name):
+    """関数全体をステージとして計測するデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def profile_iter(name, iterable):
+    """イテレータの各要素の取り出しをステージとして計測"""
+    if _profiler is None:
+        return iterable
+    return _profile_iter(name, iterable)
+
+def _profile_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+@contextmanager
+def _profile_threads(thread_profiles):
+    """実行中に開始したスレッドもそれぞれ cProfile で計測し、終了時に thread_profiles へ追加
+
+    Python 3.12 以降は呼び出し元のプロファイラが全スレッドを計測するため、スレッドごとには計測しない
+    """
+    original_run = threading.Thread.run
+    lock = threading.Lock()
+
+    def run(thread):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return original_run(thread)
+        try:
+            return original_run(thread)
+        finally:
+            profile.disable()
+            with lock:
+                thread_profiles.append(profile)
+
+    threading.Thread.run = run
+    try:
+        yield
+    finally:
+        threading.Thread.run = original_run
+
+def run_profiled(func, output_prefix):
+    """func をプロファイルしながら実行し、pstats とステージ別の集計を保存
+
+    出力: <output_prefix>.prof（pstats形式、実行中に終了したスレッドを含む。
+    プロセスプールでの解析は含まない）, <output_prefix>.stages.txt
+    """
+    global _profiler
+    _profiler = RunProfiler()
+    profile = cProfile.Profile()
+    thread_profiles = []
+    started = time.perf_counter()
+
+    try:
+        profile.enable()
+        try:
+            with _profile_threads(thread_profiles):
+                return func()
+        finally:
+            profile.disable()
+    finally:
+        report = _profiler.report(time.perf_counter() - started)
+        _profiler = None
+
+        stats = pstats.Stats(profile)
+        for thread_profile in thread_profiles:
+            stats.add(thread_profile)
+        stats.dump_stats(f"{output_prefix}.prof")
+        with open(f"{output_prefix}.stages.txt", 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+
+        print(report)
+        print(f"プロファイルを保存しました: {output_prefix}.prof, {output_prefix}.stages.txt")
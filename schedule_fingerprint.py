@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+診療担当医スケジュールの正規化とフィンガープリント
+解析結果を順序の安定した形式にシリアライズし、カレンダー単位・日単位の
+フィンガープリントで「意味のある変更」があったかを判定します
+"""
+
+import hashlib
+import json
+import os
+
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedule_state.json')
+
+def canonical_day(day_info):
+    """1日分のデータを正規化（raw_text などHTML由来の揺れは含めない）"""
+    return {
+        'day': day_info['day'],
+        'weekday': day_info['weekday'],
+        'am': list(day_info['am_doctors']),
+        'pm': list(day_info['pm_doctors']),
+    }
+
+def canonical_calendar(calendar):
+    """1か月分のデータを正規化（日付順）"""
+    return {
+        'title': calendar['title'],
+        'days': [canonical_day(day_info) for day_info in sorted(calendar['data'], key=lambda x: x['day'])],
+    }
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+def canonical_json(calendar_info):
+    """全カレンダーを正規化したJSON文字列"""
+    return _dumps([canonical_calendar(calendar) for calendar in calendar_info])
+
+def _hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def fingerprint_day(day_info):
+    """1日分のフィンガープリント"""
+    return _hash(_dumps(canonical_day(day_info)))
+
+def fingerprint_calendar(calendar):
+    """1か月分のフィンガープリント"""
+    return _hash(_dumps(canonical_calendar(calendar)))
+
+def combine_fingerprints(calendar_fingerprints):
+    """各月のフィンガープリント（順序どおり）から全体のフィンガープリントを計算"""
+    return _hash(_dumps(list(calendar_fingerprints)))
+
+def fingerprint_schedule(calendar_info):
+    """全カレンダーのフィンガープリント（各月のフィンガープリントから計算）"""
+    return combine_fingerprints(fingerprint_calendar(calendar) for calendar in calendar_info)
+
+def load_state(path=STATE_FILE):
+    """保存済みのフィンガープリントを読み込む"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def is_unchanged(key, calendar_info, path=STATE_FILE):
+    """前回保存したスケジュールから変更がないか判定"""
+    entry = load_state(path).get(key)
+    return bool(entry) and entry.get('fingerprint') == fingerprint_schedule(calendar_info)
+
+def save_fingerprints(key, titled_fingerprints, path=STATE_FILE):
+    """計算済みのフィンガープリント [(タイトル, フィンガープリント)] を保存"""
+    state = load_state(path)
+    state[key] = {
+        'fingerprint': combine_fingerprints(fingerprint for _, fingerprint in titled_fingerprints),
+        'calendars': dict(titled_fingerprints),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False, sort_keys=True)
+
+def save_state(key, calendar_info, path=STATE_FILE):
+    """スケジュールのフィンガープリントを保存"""
+    save_fingerprints(
+        key,
+        [(calendar['title'], fingerprint_calendar(calendar)) for calendar in calendar_info],
+        path,
+    )
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+診療担当医スケジュールの索引とiCalendar出力
+parse_calendar_table の結果から「医師 → 担当日」「日付 → 医師」の索引を作成し、
+医師ごと・病院全体のICSフィードを差分更新で出力します
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+SESSIONS = ('AM', 'PM')
+
+# ICSの予定に使う診療枠の時間帯（目安）
+SESSION_TIMES = {
+    'AM': ('090000', '123000'),
+    'PM': ('140000', '180000'),
+}
+
+TITLE_PATTERN = re.compile(r'(\d{4})年\s*(\d{1,2})月')
+
+# 予定の時刻のタイムゾーン（VTIMEZONE として各フィードに含める）
+TIMEZONE_ID = 'Asia/Tokyo'
+TIMEZONE_LINES = [
+    'BEGIN:VTIMEZONE',
+    f'TZID:{TIMEZONE_ID}',
+    'BEGIN:STANDARD',
+    'DTSTART:19700101T000000',
+    'TZOFFSETFROM:+0900',
+    'TZOFFSETTO:+0900',
+    'TZNAME:JST',
+    'END:STANDARD',
+    'END:VTIMEZONE',
+]
+
+HOSPITAL_FEED = 'hospital.ics'
+MANIFEST_FILE = 'manifest.json'
+
+# フィードの出力形式の版（変えた場合は担当日が同じでも全フィードを再生成する）
+FEED_FORMAT_VERSION = 2
+
+def parse_calendar_month(title):
+    """カレンダーのタイトルから (年, 月) を取得"""
+    match = TITLE_PATTERN.search(title)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+class ScheduleIndex:
+    """解析済みカレンダーの索引"""
+
+    def __init__(self, calendar_info):
+        # 医師 → [(日付, AM/PM)]
+        self.by_doctor = defaultdict(list)
+        # 日付 → {'AM': [医師], 'PM': [医師]}
+        self.by_date = {}
+
+        for calendar in calendar_info:
+            month = parse_calendar_month(calendar['title'])
+            if not month:
+                print(f"年月を判定できないカレンダーをスキップします: {calendar['title']}")
+                continue
+
+            year, month_number = month
+            for day_info in calendar['data']:
+                try:
+                    day = date(year, month_number, day_info['day'])
+                except ValueError:
+                    continue
+
+                sessions = self.by_date.setdefault(day, {'AM': [], 'PM': []})
+                for session, key in (('AM', 'am_doctors'), ('PM', 'pm_doctors')):
+                    for doctor in day_info[key]:
+                        if doctor in sessions[session]:
+                            continue
+                        sessions[session].append(doctor)
+                        self.by_doctor[doctor].append((day, session))
+
+        for assignments in self.by_doctor.values():
+            assignments.sort(key=lambda item: (item[0], SESSIONS.index(item[1])))
+
+    def doctors(self):
+        """登録されている医師の一覧"""
+        return sorted(self.by_doctor)
+
+    def days_for(self, doctor):
+        """医師の担当日一覧 [(日付, AM/PM)]"""
+        return list(self.by_doctor.get(doctor, []))
+
+    def doctors_on(self, day, session=None):
+        """指定日の担当医（session を省略するとAM/PM両方）"""
+        sessions = self.by_date.get(day, {'AM': [], 'PM': []})
+        if session:
+            return list(sessions[session])
+        return {name: list(doctors) for name, doctors in sessions.items()}
+
+    def doctor_digest(self, doctor):
+        """医師の担当日から計算したダイジェスト"""
+        payload = [(day.isoformat(), session) for day, session in self.by_doctor.get(doctor, [])]
+        return _digest(payload)
+
+    def digest(self):
+        """索引全体のダイジェスト"""
+        payload = [
+            (day.isoformat(), sessions['AM'], sessions['PM'])
+            for day, sessions in sorted(self.by_date.items())
+        ]
+        return _digest(payload)
+
+def _digest(payload):
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+def _escape_text(text):
+    """RFC 5545 のTEXT値をエスケープ"""
+    return (text.replace('\\', '\\\\')
+                .replace(';', '\\;')
+                .replace(',', '\\,')
+                .replace('\n', '\\n'))
+
+def _fold_line(line):
+    """75オクテットごとに行を折り返す（マルチバイト文字を分割しない）"""
+    folded = []
+    current = ''
+    current_size = 0
+    for char in line:
+        size = len(char.encode('utf-8'))
+        limit = 75 if not folded else 74
+        if current_size + size > limit:
+            folded.append(current)
+            current = ''
+            current_size = 0
+        current += char
+        current_size += size
+    folded.append(current)
+    return '\r\n '.join(folded)
+
+def _event_lines(uid, day, session, summary, dtstamp):
+    start, end = SESSION_TIMES[session]
+    ymd = day.strftime('%Y%m%d')
+    return [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{dtstamp}',
+        f'DTSTART;TZID={TIMEZONE_ID}:{ymd}T{start}',
+        f'DTEND;TZID={TIMEZONE_ID}:{ymd}T{end}',
+        f'SUMMARY:{_escape_text(summary)}',
+        'END:VEVENT',
+    ]
+
+def _calendar_text(name, events):
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//myseikei//calendar_parser//JA',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_escape_text(name)}',
+    ]
+    lines.extend(TIMEZONE_LINES)
+    lines.extend(events)
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold_line(line) for line in lines) + '\r\n'
+
+def _doctor_key(doctor):
+    """医師名の短いダイジェスト（UID・ファイル名の重複防止）"""
+    return hashlib.sha1(doctor.encode('utf-8')).hexdigest()[:12]
+
+def build_doctor_ics(index, doctor, dtstamp):
+    """医師1人分のICSを生成"""
+    doctor_key = _doctor_key(doctor)
+    events = []
+    for day, session in index.by_doctor.get(doctor, []):
+        uid = f"{day.strftime('%Y%m%d')}-{session}-{doctor_key}@myseikei.jp"
+        events.extend(_event_lines(uid, day, session, f"{session}：{doctor}", dtstamp))
+    return _calendar_text(f"{doctor} 担当日", events)
+
+def build_hospital_ics(index, dtstamp):
+    """病院全体のICSを生成"""
+    events = []
+    for day, sessions in sorted(index.by_date.items()):
+        for session in SESSIONS:
+            doctors = sessions[session]
+            if not doctors:
+                continue
+            uid = f"{day.strftime('%Y%m%d')}-{session}@myseikei.jp"
+            events.extend(_event_lines(uid, day, session, f"{session}：{'、'.join(doctors)}", dtstamp))
+    return _calendar_text("診療担当医表", events)
+
+def doctor_feed_name(doctor):
+    """医師ごとのICSファイル名（置き換え後に同じ名前にならないようダイジェストを付ける）"""
+    safe_name = re.sub(r'[\\/:*?"<>|\s]+', '_', doctor)
+    return f"doctor_{safe_name}_{_doctor_key(doctor)[:8]}.ics"
+
+def export_ics_feeds(index, output_dir='ics'):
+    """ICSフィードを出力（担当日が変わったフィードのみ再生成）"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+
+    manifest = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"マニフェストを読み込めませんでした（全フィードを再生成します）: {e}")
+
+    dtstamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    # フィード名 → (出力形式の版を含むダイジェスト, 生成関数)
+    feeds = {HOSPITAL_FEED: (f"{FEED_FORMAT_VERSION}:{index.digest()}", lambda: build_hospital_ics(index, dtstamp))}
+    for doctor in index.doctors():
+        feeds[doctor_feed_name(doctor)] = (
+            f"{FEED_FORMAT_VERSION}:{index.doctor_digest(doctor)}",
+            lambda doctor=doctor: build_doctor_ics(index, doctor, dtstamp),
+        )
+
+    updated = []
+    for feed_name, (digest, build) in feeds.items():
+        feed_path = os.path.join(output_dir, feed_name)
+        if manifest.get(feed_name) == digest and os.path.exists(feed_path):
+            continue
+
+        with open(feed_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(build())
+        manifest[feed_name] = digest
+        updated.append(feed_name)
+
+    # 担当がなくなった医師のフィードを削除
+    for feed_name in list(manifest):
+        if feed_name not in feeds:
+            stale_path = os.path.join(output_dir, feed_name)
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+            del manifest[feed_name]
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False, sort_keys=True)
+
+    return updated
+
+def main():
+    """メイン処理"""
+    # 複数医師・終日の記載を分割できる自動更新側の解析処理を使う（Notion APIは呼ばない）
+    from notion_auto_update import NotionCalendarUpdater
+
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else 'ics'
+    updater = NotionCalendarUpdater(None, None)
+
+    soup = updater.get_calendar_data()
+    if not soup:
+        print("Webページの取得に失敗しました。")
+        return
+
+    calendars = updater.extract_calendar_info(soup)
+    if not calendars:
+        print("カレンダーが見つかりませんでした。")
+        return
+
+    calendar_info = [
+        {'title': calendar['title'], 'data': updater.parse_calendar_table(calendar['table'])}
+        for calendar in calendars
+    ]
+    index = ScheduleIndex(calendar_info)
+    updated = export_ics_feeds(index, output_dir)
+
+    print(f"医師数: {len(index.doctors())}")
+    print(f"更新したフィード数: {len(updated)}")
+    for feed_name in updated:
+        print(f"  - {feed_name}")
+
+if __name__ == "__main__":
+    main()
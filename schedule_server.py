@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+診療担当医スケジュールの読み取り専用APIサーバー
+自動更新と同じ取得・解析処理で得たスケジュールをメモリ上の索引に保持し、JSONで返します
+スケジュールのフィンガープリントが変わったときだけ索引とレスポンスを作り直します
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from notion_auto_update import STALE_AFTER_SECONDS, CalendarFetchError, NotionCalendarUpdater
+from run_deadline import DeadlineExceeded, RunDeadline
+from schedule_fingerprint import fingerprint_schedule
+from schedule_index import ScheduleIndex
+from source_fetcher import parse_source_spec
+
+JST = timezone(timedelta(hours=9))
+
+WEEKDAYS = '月火水木金土日'
+
+# スケジュールを再取得する間隔（秒）
+REFRESH_INTERVAL = 60 * 60
+
+# まだスケジュールを取得できていない場合の再試行間隔（秒）
+RETRY_INTERVAL = 60
+
+# 1回の再取得にかける時間の上限（秒）
+REFRESH_TIMEOUT = 120
+
+DATE_PATH = re.compile(r'/date/(\d{4})-(\d{2})-(\d{2})')
+MONTH_PATH = re.compile(r'/month/(\d{4})-(\d{2})')
+
+def _day_entry(index, day):
+    sessions = index.doctors_on(day)
+    return {
+        'date': day.isoformat(),
+        'weekday': WEEKDAYS[day.weekday()],
+        'am': sessions['AM'],
+        'pm': sessions['PM'],
+    }
+
+class ScheduleStore:
+    """最新のスケジュールの索引と、エンコード済みレスポンスのキャッシュ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.index = None
+        self.fingerprint = None
+        self.updated_at = None
+        # 正規化したパス → (ステータス, 本文, ETag)
+        self._responses = {}
+
+    def update(self, calendar_info):
+        """スケジュールを差し替える（フィンガープリントが変わっていなければ何もしない）"""
+        fingerprint = fingerprint_schedule(calendar_info)
+        if fingerprint == self.fingerprint:
+            return False
+
+        index = ScheduleIndex(calendar_info)
+        with self._lock:
+            self.index = index
+            self.fingerprint = fingerprint
+            self.updated_at = datetime.now(JST).isoformat(timespec='seconds')
+            self._responses = {}
+        return True
+
+    def response(self, path):
+        """パスに対応するレスポンス (ステータス, 本文, ETag) を返す（成功したものはキャッシュ）"""
+        with self._lock:
+            index, fingerprint, responses = self.index, self.fingerprint, self._responses
+        if index is None:
+            return 503, self._encode({'error': 'スケジュールを取得中です'}), None
+
+        key = self._resolve(path)
+        cached = responses.get(key)
+        if cached:
+            return cached
+
+        status, payload = self._build(index, key)
+        if status != 200:
+            return status, self._encode(payload), None
+
+        payload['fingerprint'] = fingerprint
+        payload['updated_at'] = self.updated_at
+        body = self._encode(payload)
+        etag = f'"{fingerprint[:16]}-{hashlib.sha1(body).hexdigest()[:16]}"'
+        responses[key] = (status, body, etag)
+        return status, body, etag
+
+    @staticmethod
+    def _resolve(path):
+        """/today を日付のパスに置き換え、末尾の / を除く"""
+        path = unquote(path).rstrip('/') or '/'
+        if path == '/today':
+            return f"/date/{datetime.now(JST).date().isoformat()}"
+        return path
+
+    @staticmethod
+    def _encode(payload):
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def _build(self, index, path):
+        """レスポンスの内容を作成"""
+        if path == '/':
+            return 200, {'endpoints': ['/today', '/date/YYYY-MM-DD', '/doctor/<医師名>', '/month/YYYY-MM', '/doctors']}
+
+        if path == '/doctors':
+            return 200, {'doctors': index.doctors()}
+
+        match = DATE_PATH.fullmatch(path)
+        if match:
+            try:
+                day = date(*map(int, match.groups()))
+            except ValueError:
+                return 400, {'error': f'日付が正しくありません: {path}'}
+            if day not in index.by_date:
+                return 404, {'error': f'{day.isoformat()} のスケジュールはありません'}
+            return 200, _day_entry(index, day)
+
+        match = MONTH_PATH.fullmatch(path)
+        if match:
+            year, month = map(int, match.groups())
+            days = sorted(day for day in index.by_date if (day.year, day.month) == (year, month))
+            if not days:
+                return 404, {'error': f'{year}年{month}月のスケジュールはありません'}
+            return 200, {'month': f'{year:04d}-{month:02d}', 'days': [_day_entry(index, day) for day in days]}
+
+        if path.startswith('/doctor/'):
+            doctor = path[len('/doctor/'):]
+            if doctor not in index.by_doctor:
+                return 404, {'error': f'{doctor} の担当日はありません'}
+            return 200, {
+                'doctor': doctor,
+                'days': [
+                    {'date': day.isoformat(), 'weekday': WEEKDAYS[day.weekday()], 'session': session}
+                    for day, session in index.days_for(doctor)
+                ],
+            }
+
+        return 404, {'error': f'不明なパスです: {path}'}
+
+class ScheduleRequestHandler(BaseHTTPRequestHandler):
+    """スケジュールAPIのリクエスト処理（GET / HEAD のみ）"""
+
+    store = None
+
+    def do_GET(self):
+        self._respond(include_body=True)
+
+    def do_HEAD(self):
+        self._respond(include_body=False)
+
+    def _respond(self, include_body):
+        status, body, etag = self.store.response(urlsplit(self.path).path)
+
+        # クライアントのキャッシュが最新なら本文を返さない
+        if etag and etag in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+def load_schedule(updater, timeout=REFRESH_TIMEOUT):
+    """自動更新と同じ処理でスケジュールを取得・解析
+    
+    取得の失敗・遅延時は前回のスナップショットを使い、遅延した取得が締め切りまでに完了すればその結果を返す
+    """
+    updater.deadline = RunDeadline(timeout)
+    months = list(updater.iter_months())
+    return updater.wait_for_revalidation(updater.deadline.remaining()) or months
+
+def refresh(store, updater):
+    """スケジュールを再取得し、変更があれば索引を更新"""
+    try:
+        calendar_info = load_schedule(updater)
+    except (CalendarFetchError, DeadlineExceeded) as e:
+        logging.error(f"スケジュールの再取得に失敗しました: {e}")
+        return False
+    except Exception as e:
+        logging.error(f"スケジュールの再取得中にエラーが発生しました: {e}")
+        return False
+
+    if not calendar_info:
+        logging.error("カレンダーが見つかりませんでした")
+        return False
+
+    if store.update(calendar_info):
+        logging.info(f"スケジュールを更新しました（{len(calendar_info)}か月分、{store.fingerprint[:12]}）")
+    else:
+        logging.info("スケジュールに変更はありません")
+    return True
+
+def refresh_loop(store, updater, interval, stop_event):
+    """一定間隔でスケジュールを再取得（未取得の間は短い間隔で再試行）"""
+    while not stop_event.wait(interval if store.index is not None else min(interval, RETRY_INTERVAL)):
+        refresh(store, updater)
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description='診療担当医スケジュールAPIサーバー（読み取り専用）')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス')
+    parser.add_argument('--port', type=int, default=8080, help='待ち受けるポート')
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL,
+                        help='スケジュールを再取得する間隔（秒）')
+    parser.add_argument('--stream', action='store_true',
+                        help='ページを逐次取得し、担当医表を読み終えた時点で接続を閉じる')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='前回のスナップショットを保存・使用しない')
+    parser.add_argument('--stale-after', type=float, default=STALE_AFTER_SECONDS,
+                        help='取得がこの秒数を超えたら前回のスナップショットを使う')
+    parser.add_argument('--source', action='append', default=[], metavar='[名前=]URL',
+                        help='取得元のページ（複数指定すると並列に取得して1つにまとめる）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    updater = NotionCalendarUpdater(
+        None, None, streaming=args.stream, use_cache=not args.no_cache,
+        stale_after=args.stale_after, sources=[parse_source_spec(spec) for spec in args.source]
+    )
+    store = ScheduleStore()
+    ScheduleRequestHandler.store = store
+
+    # 最初の取得に失敗しても起動し、取得できるまで 503 を返す
+    refresh(store, updater)
+
+    stop_event = threading.Event()
+    refresher = threading.Thread(
+        target=refresh_loop, args=(store, updater, args.interval, stop_event), name='refresh', daemon=True
+    )
+    refresher.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), ScheduleRequestHandler)
+    logging.info(f"スケジュールAPIを開始しました: http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        logging.info("スケジュールAPIを停止しました")
+
+if __name__ == "__main__":
+    main()
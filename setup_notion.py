@@ -77,8 +77,9 @@ def setup_notion_config():
         if test_run != 'n':
             print("\n🔄 テスト実行中...")
             try:
-                from notion_auto_update import NotionCalendarUpdater
+                from notion_auto_update import NotionCalendarUpdater, setup_logging
                 
+                setup_logging()
                 updater = NotionCalendarUpdater(notion_token, page_id)
                 success = updater.run_update()
                 
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+取得元ページの最終成功スナップショットのキャッシュ
+最後に解析できた担当医表のHTMLと解析結果を保存し、
+取得に失敗した・遅い場合の代替として使います
+"""
+
+import hashlib
+import html
+import json
+import os
+import time
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# これより古いスナップショットは代替として使わない（秒）
+CACHE_MAX_AGE = 14 * 24 * 60 * 60
+
+def _cache_prefix(url, cache_dir):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, key)
+
+# 抽出したカレンダー（見出し + テーブル）を再解析可能な最小限のHTMLにまとめる際の前後
+SNAPSHOT_HEAD = '<!DOCTYPE html>\n<html lang="ja">\n<head><meta charset="utf-8"></head>\n<body>\n'
+SNAPSHOT_TAIL = '</body>\n</html>\n'
+
+class SnapshotWriter:
+    """解析した月を1か月ずつ一時ファイルに書き出し、最後にスナップショットを置き換える
+
+    ページ全体のテーブルや解析結果をメモリに保持せずにスナップショットを保存する
+    """
+
+    def __init__(self, url, cache_dir=CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        prefix = _cache_prefix(url, cache_dir)
+        self._paths = [(f"{prefix}{suffix}.part", prefix + suffix) for suffix in ('.html', '.json')]
+        self._html = open(self._paths[0][0], 'w', encoding='utf-8')
+        self._json = open(self._paths[1][0], 'w', encoding='utf-8')
+        self._html.write(SNAPSHOT_HEAD)
+        self._json.write(f'{{"url": {json.dumps(url)}, "calendar_info": [')
+        self._count = 0
+
+    def add(self, title, table_html, calendar):
+        """1か月分（見出し・テーブルのHTMLと解析結果）を追加"""
+        self._html.write(f"<h2>{html.escape(title)}</h2>\n{table_html}\n")
+        self._json.write((', ' if self._count else '') + json.dumps(calendar, ensure_ascii=False))
+        self._count += 1
+
+    def commit(self):
+        """書き出しを終えてスナップショットを置き換える"""
+        self._html.write(SNAPSHOT_TAIL)
+        self._json.write(f'], "fetched_at": {json.dumps(time.time())}}}')
+        self._close()
+        for part_path, path in self._paths:
+            os.replace(part_path, path)
+
+    def discard(self):
+        """書き出し途中の一時ファイルを削除（スナップショットは変更しない）"""
+        self._close()
+        for part_path, _ in self._paths:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+
+    def _close(self):
+        for f in (self._html, self._json):
+            if not f.closed:
+                f.close()
+
+def save_snapshot(url, source_html, calendar_info, cache_dir=CACHE_DIR):
+    """取得・解析に成功したスナップショットを保存"""
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = _cache_prefix(url, cache_dir)
+
+    # 書き込み途中のファイルを読まないよう一時ファイルから置き換える
+    for suffix, content in (('.html', source_html), ('.json', json.dumps({
+        'url': url,
+        'fetched_at': time.time(),
+        'calendar_info': calendar_info,
+    }, ensure_ascii=False))):
+        tmp_path = f"{prefix}{suffix}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, prefix + suffix)
+
+def load_snapshot(url, cache_dir=CACHE_DIR, max_age=CACHE_MAX_AGE):
+    """保存済みのスナップショットを読み込む（ない・古すぎる場合は None）
+
+    戻り値: {'url', 'fetched_at', 'calendar_info', 'age'}
+    """
+    path = _cache_prefix(url, cache_dir) + '.json'
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    age = time.time() - snapshot.get('fetched_at', 0)
+    if max_age is not None and age > max_age:
+        return None
+
+    snapshot['age'] = age
+    return snapshot
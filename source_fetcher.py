@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+複数の取得元ページの並列取得
+共有のコネクションプールでページを並列に取得し（ホストごとに同時接続数と間隔を制限）、
+解析はプロセスプールで並列に行います
+"""
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from run_deadline import request_timeout
+from run_profiler import stage
+
+# 同じホストへの同時リクエスト数の上限
+MAX_REQUESTS_PER_HOST = 2
+
+# 同じホストへのリクエスト開始間隔（秒）
+HOST_MIN_INTERVAL = 1.0
+
+# コネクションプールの大きさ
+POOL_SIZE = 10
+
+def parse_source_spec(spec):
+    """「名前=URL」または「URL」の形式の指定を取得元に変換"""
+    if '=' in spec and not spec.startswith(('http://', 'https://')):
+        name, url = spec.split('=', 1)
+        return {'name': name.strip(), 'url': url.strip()}
+    return {'name': urlparse(spec).netloc or spec, 'url': spec}
+
+def tag_calendars(calendar_info, source, prefix_title):
+    """解析結果に取得元を付ける（複数の取得元がある場合はタイトルの先頭にも付ける）"""
+    tagged = []
+    for calendar in calendar_info:
+        title = f"{source['name']}　{calendar['title']}" if prefix_title else calendar['title']
+        tagged.append(dict(calendar, title=title, source=source['name']))
+    return tagged
+
+class _HostLimiter:
+    """ホストごとの同時接続数とリクエスト間隔の制御"""
+
+    def __init__(self, max_requests, min_interval):
+        self._semaphore = threading.BoundedSemaphore(max_requests)
+        self._lock = threading.Lock()
+        self._min_interval = min_interval
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+class SourceFetcher:
+    """複数の取得元を共有セッションで並列に取得し、プロセスプールで解析"""
+
+    def __init__(self, deadline=None, max_per_host=MAX_REQUESTS_PER_HOST, min_interval=HOST_MIN_INTERVAL):
+        self.deadline = deadline
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self._threads = None
+        self._processes = None
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = _HostLimiter(self.max_per_host, self.min_interval)
+            return self._limiters[host]
+
+    def fetch(self, url):
+        """ページを取得してHTMLを返す"""
+        with self._limiter(url), stage("http:ページ取得"):
+            response = self.session.get(url, timeout=request_timeout(self.deadline, "ページ取得"))
+            response.raise_for_status()
+            response.encoding = response.apparent_encoding
+            return response.text
+
+    def _load(self, source, parse_func):
+        html = self.fetch(source['url'])
+        with stage("待機:解析プロセス"):
+            calendar_info = self._processes.submit(parse_func, html).result()
+        return html, calendar_info
+
+    def submit_all(self, sources, parse_func):
+        """全取得元の取得・解析を開始し、取得元と同じ順序の Future のリストを返す
+
+        各 Future の結果は (HTML, 解析結果) 。parse_func はプロセス間で受け渡せる関数であること
+        """
+        self._threads = ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix='source')
+        self._processes = ProcessPoolExecutor()
+        return [self._threads.submit(self._load, source, parse_func) for source in sources]
+
+    def close(self, wait=True):
+        """スレッド・プロセスプールとセッションを閉じる（wait=False の場合は実行中の取得を待たない）"""
+        if self._threads:
+            self._threads.shutdown(wait=wait)
+        if self._processes:
+            self._processes.shutdown(wait=wait)
+        if wait:
+            self.session.close()
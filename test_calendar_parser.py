@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+calendar_parser のストリーミング解析の確認
+ページを小さなチャンクに分けて与えても、一括解析と同じタイトル・内容になることを確認します
+"""
+
+import contextlib
+import io
+import unittest
+from types import SimpleNamespace
+
+from bs4 import BeautifulSoup
+
+from calendar_parser import (CalendarStreamParser, _detect_stream_encoding, extract_calendar_info,
+                             parse_calendar_table)
+
+SAMPLE_HTML = """<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="utf-8"></head>
+<body>
+<header><h2>お知らせ</h2></header>
+<main>
+<h2>  2025年10月　担当医表  </h2>
+<table>
+<tr><th>日</th><th>月</th><th>火</th><th>水</th><th>木</th><th>金</th><th>土</th></tr>
+<tr><td></td><td></td><td></td><td><div class="day">1</div><span>AM</span>末松医師</td><td><div class="day">2</div></td><td><div class="day">3</div>終日宇佐見医師＊</td><td class="sat" title="土曜&amp;祝日"><div class="day">4</div><span>AM</span>院長<span>PM</span>新妻医師</td></tr>
+<tr><td><div class="day">5</div><span>AM</span>新妻医師</td><td><div class="day">6</div>院長、大友医師</td><td><div class="day">7</div>AM院長PM大友医師</td><td><div class="day">8</div></td><td><div class="day">9</div><span>AM</span>院長 &amp; 大友医師</td><td><div class="day">10</div>&lt;休診&gt;</td><td><div class="day">11</div><span>PM</span>末松医師</td></tr>
+</table>
+<h2>2025年11月　担当医表</h2>
+<table>
+<tr><th>日</th><th>月</th><th>火</th><th>水</th><th>木</th><th>金</th><th>土</th></tr>
+<tr><td></td><td></td><td></td><td></td><td></td><td></td><td><div class="day">1</div><span>AM</span>大友医師 &amp; 院長</td></tr>
+<tr><td><div class="day">2</div><span>AM</span>院長<span>PM</span>新妻医師</td><td><div class="day">3</div>終日院長</td><td></td><td></td><td></td><td></td><td></td></tr>
+</table>
+</main>
+<footer>フッター</footer>
+</body>
+</html>
+"""
+
+def _quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+def _parse_all(calendars):
+    return [(calendar['title'], _quiet(parse_calendar_table, calendar['table'])) for calendar in calendars]
+
+class StreamParserTest(unittest.TestCase):
+
+    def setUp(self):
+        soup = BeautifulSoup(SAMPLE_HTML, 'html.parser')
+        self.expected = _parse_all(_quiet(extract_calendar_info, soup))
+
+    def stream(self, chunk_size):
+        parser = CalendarStreamParser()
+        calendars = []
+        for start in range(0, len(SAMPLE_HTML), chunk_size):
+            parser.feed(SAMPLE_HTML[start:start + chunk_size])
+            calendars.extend(parser.pop_calendars())
+            if parser.finished:
+                break
+        parser.close()
+        calendars.extend(parser.pop_calendars())
+        return _parse_all(calendars)
+
+    def test_titles_keep_inner_whitespace(self):
+        titles = [title for title, _ in self.stream(len(SAMPLE_HTML))]
+        self.assertEqual(titles, ['2025年10月　担当医表', '2025年11月　担当医表'])
+
+    def test_sample_parses_every_month(self):
+        # 一括解析で日付と担当医が取れていなければ、チャンク分割との比較が空のリスト同士になる
+        self.assertEqual([len(data) for _, data in self.expected], [11, 3])
+        days = {entry['day']: entry for entry in self.expected[0][1]}
+        self.assertEqual(days[4]['am_doctors'], ['院長'])
+        self.assertEqual(days[4]['pm_doctors'], ['新妻医師'])
+        self.assertIn('&', days[9]['raw_text'])
+
+    def test_small_chunks_match_full_parse(self):
+        for chunk_size in (1, 2, 3, 7, 37, 64):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.stream(chunk_size), self.expected)
+
+class StreamEncodingTest(unittest.TestCase):
+
+    RESPONSE = SimpleNamespace(headers={'Content-Type': 'text/html'}, encoding='ISO-8859-1', url='http://example.com/')
+
+    def detect(self, body, chunk_size):
+        # stream_calendar_info と同じく、判定できるまで先頭部分を溜めながら判定する
+        head = b''
+        for start in range(0, len(body), chunk_size):
+            head += body[start:start + chunk_size]
+            encoding = _detect_stream_encoding(self.RESPONSE, head)
+            if encoding:
+                return encoding
+        return _detect_stream_encoding(self.RESPONSE, head, final=True)
+
+    def test_detects_encoding_without_charset(self):
+        html = SAMPLE_HTML.replace('<meta charset="utf-8">', '')
+        for encoding in ('shift_jis', 'euc_jp', 'utf-8'):
+            body = html.encode(encoding)
+            for chunk_size in (7, 64, 16 * 1024):
+                with self.subTest(encoding=encoding, chunk_size=chunk_size):
+                    self.assertEqual(body.decode(self.detect(body, chunk_size)), html)
+
+if __name__ == '__main__':
+    unittest.main()